@@ -0,0 +1,76 @@
+import csv
+from time import perf_counter
+
+from model.cleaner import Cleaner
+
+
+def load_texts(ds_path='data/ds/dataset.csv', posts_per_text=10):
+    """
+    joins dataset rows by posts_per_text like Bot.get_posts joins the posts
+    of one group
+    """
+    with open(ds_path, encoding='utf-8') as f:
+        rows = [row[0] for row in csv.reader(f)]
+    return ['\n'.join(rows[i:i + posts_per_text])
+            for i in range(0, len(rows), posts_per_text)]
+
+
+def benchmark_cleaning(ds_path='data/ds/dataset.csv', posts_per_text=10,
+                       budgets=(40, 100), cache_size=0):
+    """
+    compares full cleaning + truncation with token-budget cleaning,
+    the cache is disabled by default to measure lemmatization itself
+    """
+    texts = load_texts(ds_path, posts_per_text)
+    words = sum(len(text.split()) for text in texts)
+    print(f'{len(texts)} texts, {words} words '
+          f'({posts_per_text} dataset rows per text)')
+
+    cleaner = Cleaner(cache_size=cache_size)
+    start = perf_counter()
+    full = [cleaner.clean_text(text) for text in texts]
+    full_time = perf_counter() - start
+    print(f'full cleaning: {full_time:.3f}s')
+
+    results = {'texts': len(texts), 'words': words, 'full': full_time}
+    for budget in budgets:
+        cleaner = Cleaner(cache_size=cache_size)
+        start = perf_counter()
+        cut = [cleaner.clean_text(text, budget) for text in texts]
+        budget_time = perf_counter() - start
+
+        expected = [' '.join(text.split()[:budget]) for text in full]
+        if cut != expected:
+            raise AssertionError(f'max_tokens={budget} changes the result')
+        print(f'max_tokens={budget}: {budget_time:.3f}s '
+              f'(x{full_time / budget_time:.1f})')
+        results[budget] = budget_time
+    return results
+
+
+def benchmark_clean_batch(ds_path='data/ds/dataset.csv', workers=(1, 2, 4),
+                          chunksize=64):
+    """times Cleaner.clean_batch on every dataset row with several workers"""
+    texts = load_texts(ds_path, posts_per_text=1)
+    cleaner = Cleaner()
+    results = {}
+    expected = None
+    for n in workers:
+        start = perf_counter()
+        cleaned = list(cleaner.clean_batch(texts, workers=n,
+                                           chunksize=chunksize,
+                                           min_parallel=0))
+        results[n] = perf_counter() - start
+        print(f'clean_batch workers={n}: {results[n]:.3f}s '
+              f'({len(texts) / results[n]:.0f} texts/s)')
+        if expected is None:
+            expected = cleaned
+        elif cleaned != expected:
+            raise AssertionError(f'workers={n} changes the result')
+        cleaner = Cleaner()
+    return results
+
+
+if __name__ == '__main__':
+    benchmark_cleaning()
+    benchmark_clean_batch()
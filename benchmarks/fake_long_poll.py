@@ -0,0 +1,82 @@
+import json
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+def message_event(user_id, message_id, text='', payload=None, group_id=1):
+    """return raw message_new update like VK sends it"""
+    message = {'date': 0, 'from_id': user_id, 'id': message_id, 'out': 0,
+               'peer_id': user_id, 'text': text}
+    if payload is not None:
+        message['payload'] = json.dumps(payload)
+    return {'type': 'message_new',
+            'object': {'message': message, 'client_info': {}},
+            'group_id': group_id,
+            'event_id': f'{user_id}-{message_id}'}
+
+
+class FakeLongPollServer:
+    """
+    Local Bots Long Poll server (https://vk.com/dev/bots_longpoll): answers
+    a_check requests of vk_api.bot_longpoll.VkBotLongPoll with the updates
+    added by push. attach makes FakeVk return it from
+    groups.getLongPollServer.
+    """
+
+    def __init__(self, batch_size=100, max_wait=1.):
+        """
+        :param batch_size: max number of updates in one answer
+        :param max_wait: max seconds a request waits for updates
+        """
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.updates = []
+        self.condition = threading.Condition()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                body = json.dumps(server.check(
+                    int(query['ts'][0]), float(query.get('wait', [1])[0])))
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(body.encode())
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.httpd.server_address[1]}'
+
+    def attach(self, fake):
+        # every listener gets all the updates, even the ones pushed before
+        # it has connected
+        fake.handlers['groups.getLongPollServer'] = lambda values: {
+            'key': 'fake', 'server': self.url, 'ts': '0'}
+
+    def push(self, updates):
+        with self.condition:
+            self.updates.extend(updates)
+            self.condition.notify_all()
+
+    def check(self, ts, wait):
+        with self.condition:
+            self.condition.wait_for(lambda: len(self.updates) > ts,
+                                    min(wait, self.max_wait))
+            updates = self.updates[ts:ts + self.batch_size]
+            return {'ts': str(ts + len(updates)), 'updates': updates}
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
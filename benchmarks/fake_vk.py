@@ -0,0 +1,248 @@
+import re
+import json
+import random
+import threading
+from time import sleep, monotonic, perf_counter
+from collections import Counter, deque
+
+import vk_api
+from vk_api.exceptions import ApiError
+
+from web.rate_limiter import RateLimitMixin
+
+ACCESS_DENIED = {'error_code': 15, 'error_msg': 'Access denied'}
+TOO_MANY_REQUESTS = {'error_code': 6,
+                     'error_msg': 'Too many requests per second'}
+EXECUTE_CALL = re.compile(r'API\.([\w.]+)\(')
+
+
+class FakeVk(vk_api.VkApi):
+    """
+    Local stand-in for vk_api.VkApi. Answers wall.get, users.getSubscriptions,
+    groups.getById, messages.send and execute made by vk_api.requests_pool
+    from recorded or generated walls, every request can be delayed by
+    latency seconds to imitate the network. With rps_limit, requests over
+    the limit in a second fail with error 6 like in VK.
+
+    Generated subscriptions follow a power law, so popular groups are
+    shared by many users like in the real VK.
+    """
+
+    def __init__(self, texts=None, walls=None, groups=2000, group_ids=None,
+                 posts_per_group=10, subscriptions=100, closed_share=0.02,
+                 disabled_share=0.01, ads_share=0.05, latency=0., rps_limit=None,
+                 churn=0.05, seed=0):
+        """
+        :param texts: texts for generated posts
+        :param walls: {group_id: [post, ...]} recorded by record_walls,
+        used instead of generated walls
+        :param groups: number of generated groups
+        :param group_ids: IDs of generated groups, 1..groups by default
+        :param posts_per_group: number of posts on a generated wall
+        :param subscriptions: number of subscriptions of every user
+        :param closed_share: share of closed groups
+        :param disabled_share: share of groups that are not closed
+        but whose walls can not be read
+        :param ads_share: share of posts marked as ads
+        :param latency: delay of every call in seconds
+        :param rps_limit: number of requests allowed in a second
+        :param churn: share of subscriptions of every user replaced when
+        the generation is increased
+        :param seed: random seed
+        """
+        super().__init__(token='fake')
+        rng = random.Random(seed)
+        if walls is None:
+            walls = {}
+            post_id = 0
+            for group_id in group_ids or range(1, groups + 1):
+                walls[group_id] = []
+                for _ in range(posts_per_group):
+                    post_id += 1
+                    walls[group_id].append({
+                        'id': post_id,
+                        'owner_id': -group_id,
+                        'text': rng.choice(texts),
+                        'marked_as_ads': int(rng.random() < ads_share),
+                    })
+                walls[group_id].reverse()
+        self.walls = {int(group_id): posts
+                      for group_id, posts in walls.items()}
+        self.group_ids = sorted(self.walls)
+        unavailable = rng.sample(
+            self.group_ids,
+            int(len(self.group_ids) * (closed_share + disabled_share)))
+        self.closed = set(
+            unavailable[:int(len(self.group_ids) * closed_share)])
+        self.disabled = set(unavailable) - self.closed
+        self.weights = [1 / (rank + 1) ** 0.8
+                        for rank in range(len(self.group_ids))]
+        self.subscriptions = subscriptions
+        self.churn = churn
+        # increased to make users subscribe to some other groups
+        self.generation = 0
+        self.latency = latency
+        self.rps_limit = rps_limit
+        self.request_times = deque()
+
+        self.calls = Counter()
+        self.execute_calls = Counter()
+        self.rejected = 0
+        self.sent = []
+        self.stats_lock = threading.Lock()
+
+        self.handlers = {
+            'wall.get': self.wall_get,
+            'users.getSubscriptions': self.users_get_subscriptions,
+            'groups.getById': self.groups_get_by_id,
+            'messages.send': self.messages_send,
+        }
+
+    def method(self, method, values=None, raw=False, **kwargs):
+        values = values or {}
+        with self.stats_lock:
+            now = monotonic()
+            while self.request_times and self.request_times[0] < now - 1:
+                self.request_times.popleft()
+            limited = (self.rps_limit is not None and
+                       len(self.request_times) >= self.rps_limit)
+            if limited:
+                self.rejected += 1
+            else:
+                self.request_times.append(now)
+                self.calls[method] += 1
+        if limited:
+            raise ApiError(self, method, values, raw, TOO_MANY_REQUESTS)
+        if self.latency:
+            sleep(self.latency)
+
+        if method == 'execute':
+            response = self.execute(values['code'])
+        else:
+            response = self.handlers[method](values)
+            if isinstance(response, dict) and 'error_code' in response:
+                raise ApiError(self, method, values, raw, response)
+            response = {'response': response}
+        return response if raw else response['response']
+
+    def reset(self):
+        with self.stats_lock:
+            self.calls.clear()
+            self.execute_calls.clear()
+            self.rejected = 0
+            self.sent.clear()
+
+    def execute(self, code):
+        """
+        runs the VKScript made by vk_api.requests_pool: calls with the
+        parameters in the code, or in the values list of a loop
+        """
+        decoder = json.JSONDecoder()
+        calls = []
+        if 'values[i]' in code:
+            method = EXECUTE_CALL.search(code).group(1)
+            default_values = {}
+            if 'def_values' in code:
+                start = code.index('def_values = ') + len('def_values = ')
+                default_values = decoder.raw_decode(code, start)[0]
+            start = code.index('values = ', code.index('values = ') + 1
+                               if 'def_values' in code else 0)
+            values_list = decoder.raw_decode(code, start + len('values = '))[0]
+            key = re.search(r'def_values\.(\w+) = values\[i\]', code)
+            for value in values_list:
+                if key:
+                    value = {**default_values, key.group(1): value}
+                calls.append((method, value))
+        else:
+            for match in EXECUTE_CALL.finditer(code):
+                calls.append((match.group(1),
+                              decoder.raw_decode(code, match.end())[0]))
+        if len(calls) > 25:
+            return {'error': {'error_code': 13,
+                              'error_msg': 'Too many API calls'}}
+
+        response = []
+        errors = []
+        for method, values in calls:
+            with self.stats_lock:
+                self.execute_calls[method] += 1
+            result = self.handlers[method](values)
+            if isinstance(result, dict) and 'error_code' in result:
+                response.append(False)
+                errors.append({'method': method, **result})
+            else:
+                response.append(result)
+        result = {'response': response}
+        if errors:
+            result['execute_errors'] = errors
+        return result
+
+    def wall_get(self, values):
+        group_id = -int(values['owner_id'])
+        if (group_id in self.closed or group_id in self.disabled or
+                group_id not in self.walls):
+            return ACCESS_DENIED
+        posts = self.walls[group_id]
+        return {'count': len(posts),
+                'items': posts[:int(values.get('count', 20))]}
+
+    def users_get_subscriptions(self, values):
+        rng = random.Random(int(values['user_id']))
+        count = min(self.subscriptions, len(self.group_ids))
+        group_ids = set()
+        while len(group_ids) < count:
+            group_ids.update(rng.choices(self.group_ids, self.weights,
+                                         k=count - len(group_ids)))
+        for generation in range(1, self.generation + 1):
+            rng = random.Random(f'{values["user_id"]}-{generation}')
+            group_ids -= set(rng.sample(sorted(group_ids),
+                                        int(count * self.churn)))
+            while len(group_ids) < count:
+                group_ids.update(rng.choices(self.group_ids, self.weights,
+                                             k=count - len(group_ids)))
+        return {'count': count,
+                'items': [{'id': group_id,
+                           'name': f'group {group_id}',
+                           'is_closed': int(group_id in self.closed),
+                           'type': 'page'} for group_id in group_ids]}
+
+    def groups_get_by_id(self, values):
+        group_ids = str(values.get('group_ids') or values['group_id'])
+        return [{'id': int(group_id),
+                 'name': f'group {group_id}',
+                 'screen_name': f'club{group_id}'}
+                for group_id in group_ids.split(',')]
+
+    def messages_send(self, values):
+        with self.stats_lock:
+            self.sent.append((values['user_id'], values['message'],
+                              perf_counter()))
+            return len(self.sent)
+
+
+class RateLimitedFakeVk(RateLimitMixin, FakeVk):
+    """FakeVk limited like web.rate_limiter.RateLimitedVkApi"""
+
+    def __init__(self, *args, rps=3, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.init_rate_limit(f'fake-{id(self)}', rps)
+
+
+def record_walls(api, group_ids, path, count=10):
+    """saves walls of the groups got through the real api to a json file"""
+    walls = {}
+    for group_id in group_ids:
+        try:
+            posts = api.wall.get(owner_id=-group_id, count=count)['items']
+        except ApiError:
+            continue
+        walls[group_id] = [{key: post.get(key) for key in
+                            ('id', 'owner_id', 'text', 'marked_as_ads')}
+                           for post in posts]
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(walls, f, ensure_ascii=False)
+
+
+def load_walls(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
@@ -0,0 +1,199 @@
+"""
+Load test of message handling against a local long poll server:
+
+    python -m benchmarks.load_test [--users 50] [--shards 2 4] [--latency 0.05]
+
+Every user asks for an analysis at once. The bot is run with a thread per
+message, with the worker pool, and as a ShardedListener with every number
+of --shards worker processes. VK is replaced with benchmarks.fake_vk.FakeVk,
+databases are copied to a temporary directory for every run.
+"""
+import io
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from queue import Empty
+from time import time
+from functools import partial
+from contextlib import redirect_stdout
+
+from benchmarks.cleaning import load_texts
+from benchmarks.fake_vk import FakeVk
+from benchmarks.fake_long_poll import FakeLongPollServer, message_event
+from benchmarks.suite import summary, synthetic_model, default_output
+from database.db_session import DataBase
+from model.predictor import INFERENCE_FILE, COMPACT_INFERENCE_FILE
+
+# the last message of an analysis
+ANALYSIS_DONE = ('Страница 1', 'Проанализировать ещё раз')
+# output of the bots, never closed: print() of a bot thread still uses it
+# after sys.stdout is restored
+DEVNULL = open(os.devnull, 'w')
+
+
+class ReportingFakeVk(FakeVk):
+    """FakeVk that puts (user_id, message, time) of sent messages to queue"""
+
+    def __init__(self, replies, **kwargs):
+        super().__init__(**kwargs)
+        self.replies = replies
+
+    def messages_send(self, values):
+        self.replies.put((int(values['user_id']), values['message'], time()))
+        return super().messages_send(values)
+
+
+def make_bot(workdir, model_name, models_dir, fake_kwargs, replies):
+    """makes a Bot with fake VK sessions, its output is dropped"""
+    from web.Bot import Bot
+
+    sys.stdout = DEVNULL
+    groups_db = DataBase(f'sqlite:///{workdir}/groups.sqlite'
+                         '?check_same_thread=false')
+    users_db = DataBase(f'sqlite:///{workdir}/users.sqlite'
+                        '?check_same_thread=false')
+    fake = ReportingFakeVk(replies, **fake_kwargs)
+    bot = Bot(users_db, groups_db, model_name, models_dir=models_dir,
+              group_vk_session=fake, service_vk_session=fake)
+    replies.put((0, 'ready', time()))
+    return bot
+
+
+def run_load(mode, shards, users, model_name, models_dir, fake_kwargs,
+             timeout=300):
+    """
+    :param mode: 'thread' or 'pool' dispatch of the bot
+    :param shards: number of worker processes, 0 to run the bot here
+    :return: latencies of the analyses and throughput
+    """
+    from web.sharding import ShardedListener
+
+    workdir = tempfile.mkdtemp(prefix='vk-load-')
+    os.environ['DISPATCH_MODE'] = mode
+    server = FakeLongPollServer()
+    stdout = sys.stdout
+    try:
+        shutil.copy('database/db.sqlite', f'{workdir}/groups.sqlite')
+        with redirect_stdout(io.StringIO()):
+            users_db = DataBase(f'sqlite:///{workdir}/users.sqlite')
+        users_db.UserStatuses.__table__.create(users_db.engine,
+                                               checkfirst=True)
+
+        replies = multiprocessing.Queue()
+        make = partial(make_bot, workdir, model_name, models_dir,
+                       fake_kwargs, replies)
+        if shards:
+            listener_vk = FakeVk(texts=[''])
+            server.attach(listener_vk)
+            target = ShardedListener(make, shards,
+                                     group_vk_session=listener_vk)
+            target.start()
+        else:
+            target = make()
+            server.attach(target.groups_session)
+        for _ in range(max(shards, 1)):
+            replies.get(timeout=timeout)
+
+        def listen():
+            try:
+                target.listen()
+            except Exception:
+                # the server is closed after the run
+                pass
+
+        threading.Thread(target=listen, daemon=True).start()
+        sent = {}
+        for user_id in range(1, users + 1):
+            sent[user_id] = time()
+            server.push([message_event(user_id, user_id,
+                                       payload={'button': 'start_analysis'})])
+
+        start = min(sent.values())
+        latencies = {}
+        messages = 0
+        while len(latencies) < users and time() - start < timeout:
+            try:
+                user_id, message, sent_time = replies.get(timeout=1)
+            except Empty:
+                continue
+            messages += 1
+            if message.startswith(ANALYSIS_DONE):
+                latencies[user_id] = sent_time - sent[user_id]
+        wall_time = time() - start
+
+        if shards:
+            target.close()
+    finally:
+        sys.stdout = stdout
+        server.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    result = summary(list(latencies.values()) or [0.])
+    result.update({'mode': mode,
+                   'shards': shards,
+                   'analyses': len(latencies),
+                   'messages': messages,
+                   'wall_time': wall_time,
+                   'users_per_second': len(latencies) / wall_time})
+    return result
+
+
+def run_load_test(model_name='vk_not_filtered', ds_path='data/ds/dataset.csv',
+                  users=50, shards=(2,), latency=0.05, output=None):
+    workdir = tempfile.mkdtemp(prefix='vk-load-models-')
+    try:
+        rows = load_texts(ds_path, posts_per_text=1)
+        models_dir = 'models'
+        if not any(os.path.exists(f'models/{model_name}/{file}')
+                   for file in (INFERENCE_FILE, COMPACT_INFERENCE_FILE)):
+            models_dir = f'{workdir}/models'
+            synthetic_model(model_name, models_dir, rows)
+
+        os.environ.setdefault('GROUP_ID', '1')
+        os.environ.setdefault('ADMIN_PWD', 'benchmark')
+        fake_kwargs = {'texts': rows, 'latency': latency}
+        results = {}
+        for mode, shard_count in ([('thread', 0), ('pool', 0)] +
+                                  [('pool', count) for count in shards]):
+            title = f'{mode}_{shard_count}_shards'
+            print(f'{title} ...')
+            results[title] = run_load(mode, shard_count, users, model_name,
+                                      models_dir, fake_kwargs)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {'meta': {'users': users, 'vk_latency': latency,
+                        'cpu_count': os.cpu_count(),
+                        'synthetic_model': models_dir != 'models'},
+               'load': results}
+    output = output or default_output().replace('.json', '-load.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    for title, stats in results['load'].items():
+        print(f'{title.ljust(20)} {stats["analyses"]:4} analyses  '
+              f'p50 {stats["p50"]:7.2f} s  p90 {stats["p90"]:7.2f} s  '
+              f'{stats["users_per_second"]:7.2f} users/s')
+    print(f'Results saved to {output}')
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--model', default='vk_not_filtered')
+    parser.add_argument('--dataset', default='data/ds/dataset.csv')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--shards', type=int, nargs='*', default=[2])
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='seconds added to every VK call')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    run_load_test(model_name=args.model, ds_path=args.dataset,
+                  users=args.users, shards=args.shards,
+                  latency=args.latency, output=args.output)
@@ -0,0 +1,445 @@
+"""
+Offline benchmarks of the analysis hot path:
+
+    python -m benchmarks.suite [--latency 0.05] [--compare old.json]
+
+VK is replaced with benchmarks.fake_vk.FakeVk, databases are copied to a
+temporary directory. Without models/<model>/inference*.npz the model is
+replaced with random weights of the same shape.
+"""
+import io
+import os
+import sys
+import json
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from time import perf_counter, strftime
+from functools import partial
+from collections import Counter
+from contextlib import redirect_stdout
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmarks.cleaning import load_texts
+from benchmarks.fake_vk import FakeVk, RateLimitedFakeVk, load_walls
+from database.db_session import DataBase
+from model.cleaner import Cleaner
+from model.numpy_model import NumpyModel
+from model.predictor import (Predictor, read_params, INFERENCE_FILE,
+                             COMPACT_INFERENCE_FILE)
+from model.prediction_cache import PredictionCache
+from web.catalog import GroupsCatalog, RecommendationCatalog
+from web.user_states import UserStates
+
+
+# the first message with classes sent by an analysis
+FIRST_RESULT = ('Предварительный результат', 'В ходе анализа')
+
+
+def summary(latencies, items=None):
+    """return throughput and latency percentiles (seconds) of timed calls"""
+    latencies = np.array(latencies, dtype=float)
+    total = float(latencies.sum())
+    items = len(latencies) if items is None else items
+    return {
+        'calls': len(latencies),
+        'total': total,
+        'throughput': items / total if total else None,
+        'p50': float(np.percentile(latencies, 50)),
+        'p90': float(np.percentile(latencies, 90)),
+        'p99': float(np.percentile(latencies, 99)),
+        'max': float(latencies.max()),
+    }
+
+
+def timed(function, *args, **kwargs):
+    start = perf_counter()
+    result = function(*args, **kwargs)
+    return perf_counter() - start, result
+
+
+def synthetic_model(model_name, models_dir, texts, seed=0):
+    """
+    makes models_dir/model_name with the class names and params of the real
+    model, the most frequent words of texts as vocabulary and random weights
+    """
+    os.makedirs(f'{models_dir}/{model_name}')
+    for file in 'class_names.txt', 'params.txt':
+        if os.path.exists(f'models/{model_name}/{file}'):
+            shutil.copy(f'models/{model_name}/{file}',
+                        f'{models_dir}/{model_name}/{file}')
+    with open(f'{models_dir}/{model_name}/class_names.txt',
+              encoding='utf-8') as f:
+        class_count = len(f.readline().rstrip().split(','))
+    max_features, sequence_length, embedding_dim = read_params(model_name)
+
+    words = Counter(word for text in texts for word in text.split())
+    vocabulary = ['', '[UNK]'] + [
+        word for word, _ in words.most_common(max_features - 2)]
+    rng = np.random.default_rng(seed)
+    NumpyModel(
+        vocabulary=vocabulary,
+        embedding=rng.normal(0, 0.1, (max_features + 1, embedding_dim)
+                             ).astype(np.float32),
+        kernel=rng.normal(0, 0.1, (embedding_dim, class_count)
+                          ).astype(np.float32),
+        bias=np.zeros(class_count, dtype=np.float32),
+        sequence_length=sequence_length,
+    ).save(f'{models_dir}/{model_name}/{INFERENCE_FILE}')
+
+
+def fake_group_ids(groups_db, known_share, groups=2000, seed=0):
+    """
+    return IDs for fake groups, known_share of them are groups with a
+    subject in the Groups table, the other ones are not in the database
+    """
+    rng = random.Random(seed)
+    with groups_db.session() as session:
+        labeled = [group_id for group_id, in
+                   session.query(groups_db.Groups.group_id)]
+    known = rng.sample(labeled, min(len(labeled), int(groups * known_share)))
+    start = max(labeled, default=0) + 1
+    group_ids = known + list(range(start, start + groups - len(known)))
+    rng.shuffle(group_ids)
+    return group_ids
+
+
+def bench_cleaning(texts, sequence_length):
+    results = {}
+    for title, max_tokens, cache_size in (
+            ('full', None, 0),
+            ('budget', sequence_length, 0),
+            ('budget_cached', sequence_length, 100000)):
+        cleaner = Cleaner(cache_size=cache_size)
+        latencies = [timed(cleaner.clean_text, text, max_tokens)[0]
+                     for text in texts]
+        results[title] = summary(latencies)
+    return results
+
+
+def bench_inference(predictor, texts, batch_sizes):
+    cleaned = predictor.clean(texts)
+    results = {}
+    for batch_size in batch_sizes:
+        latencies = [timed(predictor.model.predict,
+                           cleaned[i:i + batch_size])[0]
+                     for i in range(0, len(cleaned), batch_size)]
+        results[batch_size] = summary(latencies, items=len(cleaned))
+    return results
+
+
+def bench_db(groups_db, users_db, model_name, class_names, repeat=100):
+    rng = random.Random(0)
+    with groups_db.session() as session:
+        subjects = [subject for subject, in
+                    session.query(groups_db.Groups.subject).distinct()]
+        group_ids = [group_id for group_id, in
+                     session.query(groups_db.Groups.group_id)]
+
+    def recommendations():
+        top = rng.sample(subjects, min(3, len(subjects)))
+        with groups_db.session() as session:
+            return session.query(groups_db.Groups).filter(
+                groups_db.Groups.subject.in_(top)).all()
+
+    catalogs = {'db': RecommendationCatalog(groups_db),
+                'memory': GroupsCatalog(groups_db)}
+
+    def recommendation_page(catalog):
+        top = rng.sample(subjects, min(3, len(subjects)))
+        return catalog.page(top, rng.randint(1, catalog.size(top) // 10 + 1))
+
+    with users_db.session() as session:
+        for user_id in range(1, 1001):
+            session.merge(users_db.UserStatuses(
+                user_id=user_id, status='show_page', page=1,
+                subjects='&'.join(class_names[:3])))
+        session.commit()
+
+    def get_user():
+        table = users_db.UserStatuses
+        with users_db.session() as session:
+            return session.query(table).filter(
+                table.user_id == rng.randint(1, 1000)).first()
+
+    # the users have written to the bot before
+    user_states = UserStates(users_db)
+    for user_id in range(1, 1001):
+        user_states.get(user_id)
+
+    def set_cached_user():
+        user_id = rng.randint(1, 1000)
+        user_states.get(user_id)
+        user_states.set(user_id, status='show_page', page=2)
+
+    cache = PredictionCache(groups_db)
+    scores = [0.] * len(class_names)
+
+    def cache_put():
+        cache.put(model_name, {group_id: (1, scores) for group_id in
+                               rng.sample(group_ids, 100)})
+
+    def cache_get():
+        return cache.get(model_name, rng.sample(group_ids, 100))
+
+    results = {name: summary([timed(query)[0] for _ in range(repeat)])
+               for name, query in (
+                   ('recommendations', recommendations),
+                   ('recommendation_page',
+                    partial(recommendation_page, catalogs['db'])),
+                   ('memory_page',
+                    partial(recommendation_page, catalogs['memory'])),
+                   ('get_user', get_user),
+                   ('cached_user', set_cached_user),
+                   ('prediction_cache_put', cache_put),
+                   ('prediction_cache_get', cache_get))}
+    user_states.close()
+    return results
+
+
+def bench_analysis(fake, groups_db, users_db, model_name, models_dir,
+                   users, concurrency):
+    from web.Bot import Bot
+
+    os.environ.setdefault('GROUP_ID', '1')
+    os.environ.setdefault('ADMIN_PWD', 'benchmark')
+    with redirect_stdout(io.StringIO()):
+        bot = Bot(users_db, groups_db, model_name, models_dir=models_dir,
+                  group_vk_session=fake, service_vk_session=fake)
+
+    starts = {}
+
+    def analysis(user_id):
+        starts[user_id] = perf_counter()
+        return timed(bot.command_start_analysis, user_id)[0]
+
+    results = {}
+    user_ids = list(range(1, users + 1))
+    # 'repeat' analyses the same users again after they have changed some
+    # of their subscriptions, every other run starts with empty databases.
+    # Progressive analysis predicts and sends a message chunk by chunk, so
+    # unless it stops early it is slower than 'sequential_full' (p50 about
+    # 200 vs 90 ms without latency and 325 vs 215 ms with 20 ms on the
+    # synthetic walls, which are never stable); it pays off only when the
+    # top is stable after a few chunks
+    for title, workers, progressive in (
+            ('sequential', 1, True),
+            ('concurrent', concurrency, True),
+            ('sequential_full', 1, False),
+            ('repeat', 1, True)):
+        bot.progressive = progressive
+        fake.reset()
+        if title == 'repeat':
+            fake.generation += 1
+        else:
+            for db, tables in ((groups_db, (groups_db.GroupPredictions,
+                                            groups_db.GroupWalls,
+                                            groups_db.GroupPosts)),
+                               (users_db, (users_db.UserSnapshots,))):
+                with db.session() as session:
+                    for table in tables:
+                        session.query(table).delete()
+                    session.commit()
+        start = perf_counter()
+        with redirect_stdout(io.StringIO()), \
+                ThreadPoolExecutor(workers) as executor:
+            latencies = list(executor.map(analysis, user_ids))
+        wall_time = perf_counter() - start
+
+        first_results = {}
+        for user_id, message, sent in fake.sent:
+            if message.startswith(FIRST_RESULT) and \
+                    user_id not in first_results:
+                first_results[user_id] = sent - starts[user_id]
+        results[title] = summary(latencies)
+        results[title].update({
+            'workers': workers,
+            'progressive': progressive,
+            'wall_time': wall_time,
+            'users_per_second': users / wall_time,
+            'first_result': summary(list(first_results.values())),
+            'vk_calls': dict(fake.calls),
+            'vk_calls_per_user': sum(fake.calls.values()) / users,
+            'wall_get_per_user': fake.execute_calls['wall.get'] / users,
+            'vk_rejected': fake.rejected,
+        })
+    results['prediction_cache'] = bot.prediction_cache.stats()
+    results['single_flight'] = bot.single_flight.stats()
+    results['post_store'] = bot.post_store.stats()
+    results['known_groups'] = bot.known_groups.stats()
+    results['snapshots'] = bot.snapshots.stats()
+    results['user_states'] = bot.user_states.stats()
+    results['users_db'] = users_db.stats()
+    results['groups_db'] = groups_db.stats()
+    return results
+
+
+def run_suite(model_name='vk_not_filtered', ds_path='data/ds/dataset.csv',
+              walls=None, users=20, concurrency=8, latency=0., rps=None,
+              known_share=0.3,
+              batch_sizes=(1, 10, 100, 500), synthetic=False, output=None):
+    """runs every benchmark and saves results to output json"""
+    workdir = tempfile.mkdtemp(prefix='vk-bench-')
+    try:
+        rows = load_texts(ds_path, posts_per_text=1)
+        texts = load_texts(ds_path, posts_per_text=10)
+
+        models_dir = 'models'
+        has_arrays = any(
+            os.path.exists(f'models/{model_name}/{file}')
+            for file in (INFERENCE_FILE, COMPACT_INFERENCE_FILE))
+        if synthetic or not has_arrays:
+            models_dir = f'{workdir}/models'
+            synthetic_model(model_name, models_dir, rows)
+        predictor = Predictor(model_name, models_dir=models_dir)
+
+        shutil.copy('database/db.sqlite', f'{workdir}/groups.sqlite')
+        with redirect_stdout(io.StringIO()):
+            groups_db = DataBase(f'sqlite:///{workdir}/groups.sqlite'
+                                 '?check_same_thread=false')
+            users_db = DataBase(f'sqlite:///{workdir}/users.sqlite'
+                                '?check_same_thread=false')
+        users_db.UserStatuses.__table__.create(users_db.engine,
+                                               checkfirst=True)
+
+        fake_kwargs = {'texts': rows,
+                       'walls': load_walls(walls) if walls else None,
+                       'group_ids': fake_group_ids(groups_db, known_share),
+                       'latency': latency}
+        if rps:
+            fake = RateLimitedFakeVk(rps=rps, rps_limit=rps, **fake_kwargs)
+        else:
+            fake = FakeVk(**fake_kwargs)
+
+        print('Cleaning ...')
+        cleaning = bench_cleaning(texts, predictor.sequence_length)
+        print('Inference ...')
+        inference = bench_inference(predictor, rows, batch_sizes)
+        print('Databases ...')
+        db = bench_db(groups_db, users_db, model_name, predictor.class_names)
+        print('Analysis ...')
+        analysis = bench_analysis(fake, groups_db, users_db, model_name,
+                                  models_dir, users, concurrency)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {
+        'meta': {
+            'time': strftime('%Y-%m-%d %H:%M:%S'),
+            'commit': git_commit(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'model': model_name,
+            'backend': predictor.backend,
+            'synthetic_model': models_dir != 'models',
+            'recorded_walls': walls,
+            'users': users,
+            'concurrency': concurrency,
+            'vk_latency': latency,
+            'vk_rps': rps,
+            'known_share': known_share,
+        },
+        'cleaning': cleaning,
+        'inference': inference,
+        'db': db,
+        'analysis': analysis,
+    }
+
+    output = output or default_output()
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print_results(results)
+    print(f'Results saved to {output}')
+    return results
+
+
+def default_output():
+    return f'benchmarks/results/{strftime("%Y%m%d-%H%M%S")}.json'
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(results, prefix=''):
+    """return {'section.name.metric': value} for numeric results"""
+    flat = {}
+    for key, value in results.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{name}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def print_results(results):
+    for section in 'cleaning', 'inference', 'db', 'analysis':
+        print(f'== {section}')
+        for name, stats in results[section].items():
+            if 'p50' not in stats:
+                continue
+            print(f'{str(name).ljust(24)} '
+                  f'p50 {stats["p50"] * 1000:9.2f} ms  '
+                  f'p90 {stats["p90"] * 1000:9.2f} ms  '
+                  f'p99 {stats["p99"] * 1000:9.2f} ms  '
+                  f'{stats["throughput"] or 0:10.1f} /s')
+
+
+def compare(old_path, new_path):
+    """prints latency and throughput changes between two saved runs"""
+    with open(old_path, encoding='utf-8') as f:
+        old = flatten(json.load(f))
+    with open(new_path, encoding='utf-8') as f:
+        new = flatten(json.load(f))
+    for name in sorted(old.keys() & new.keys()):
+        if not name.endswith(('.p50', '.p90', '.throughput',
+                              '.vk_calls_per_user', '.wall_get_per_user')) \
+                or not old[name]:
+            continue
+        print(f'{name.ljust(48)} {old[name]:12.5f} -> {new[name]:12.5f} '
+              f'({new[name] / old[name] - 1:+.1%})')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--model', default='vk_not_filtered')
+    parser.add_argument('--dataset', default='data/ds/dataset.csv')
+    parser.add_argument('--walls', help='json saved by record_walls')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.,
+                        help='seconds added to every VK call')
+    parser.add_argument('--rps', type=float,
+                        help='requests per second allowed by the fake VK, '
+                             'the sessions are limited the same way')
+    parser.add_argument('--known-share', type=float, default=0.3,
+                        help='share of fake groups that have a subject '
+                             'in the groups database')
+    parser.add_argument('--synthetic', action='store_true',
+                        help='use random weights even if the model exists')
+    parser.add_argument('--output')
+    parser.add_argument('--compare', metavar='OLD_JSON',
+                        help='compare the results with a previous run')
+    args = parser.parse_args()
+
+    output = args.output or default_output()
+    run_suite(model_name=args.model, ds_path=args.dataset, walls=args.walls,
+              users=args.users, concurrency=args.concurrency,
+              latency=args.latency, rps=args.rps,
+              known_share=args.known_share, synthetic=args.synthetic,
+              output=output)
+    if args.compare:
+        compare(args.compare, output)
@@ -1,10 +1,52 @@
+import os
+from time import perf_counter
+from contextlib import contextmanager
 import sqlalchemy as sa
 import sqlalchemy.orm as orm
+from sqlalchemy.exc import OperationalError, ProgrammingError
 from sqlalchemy.orm import Session
+from sqlalchemy.pool import QueuePool
 import sqlalchemy.ext.declarative as dec
+from database.pool_monitor import PoolMonitor
 from database.models.Groups import groups
 from database.models.GroupsIds import groups_ids
 from database.models.UserStatuses import user_statuses
+from database.models.GroupPredictions import group_predictions
+from database.models.GroupWalls import group_walls
+from database.models.GroupPosts import group_posts
+from database.models.AnalysisJobs import analysis_jobs
+from database.models.UserSnapshots import user_snapshots
+
+
+def engine_options(url):
+    """
+    pool settings of the database, set with DB_POOL_SIZE, DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT and DB_POOL_RECYCLE
+    """
+    options = {'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+               'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+               'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 30))}
+    if url.get_backend_name() != 'sqlite':
+        # the server closes idle connections
+        options.update(pool_pre_ping=True, pool_recycle=int(
+            os.environ.get('DB_POOL_RECYCLE', 30 * 60)))
+    elif url.database and url.database != ':memory:':
+        # connections are shared by the threads, writers wait for each
+        # other up to SQLITE_BUSY_TIMEOUT seconds
+        options.update(poolclass=QueuePool, connect_args={
+            'check_same_thread': False,
+            'timeout': float(os.environ.get('SQLITE_BUSY_TIMEOUT', 30))})
+    else:
+        options = {}
+    return options
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # readers do not wait for writers in the WAL mode
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.close()
 
 
 class DataBase:
@@ -16,14 +58,71 @@ class DataBase:
 
         print(f'Connecting to the database with address {db_url}')
 
-        engine = sa.create_engine(db_url)
+        url = sa.engine.url.make_url(db_url)
+        engine = sa.create_engine(url, **engine_options(url))
+        if (url.get_backend_name() == 'sqlite' and
+                url.database and url.database != ':memory:'):
+            sa.event.listen(engine, 'connect', set_sqlite_pragmas)
+        self.engine = engine
         self.factory = orm.sessionmaker(bind=engine)
+        self.monitor = PoolMonitor(
+            engine,
+            leak_timeout=float(os.environ.get('DB_LEAK_TIMEOUT', 60)))
 
         self.base.metadata.create_all(engine)
 
         self.Groups = groups(self.base)
         self.GroupsIds = groups_ids(self.base)
         self.UserStatuses = user_statuses(self.base)
+        self.GroupPredictions = group_predictions(self.base)
+        self.GroupWalls = group_walls(self.base)
+        self.GroupPosts = group_posts(self.base)
+        self.AnalysisJobs = analysis_jobs(self.base)
+        self.UserSnapshots = user_snapshots(self.base)
+
+        # indexes added after the existing databases were created
+        new_indexes = [index for index in self.Groups.__table__.indexes
+                       if index.name == 'ix_Groups_subject_group_id']
+        for index in new_indexes:
+            try:
+                index.create(engine)
+            except (OperationalError, ProgrammingError):
+                # the index exists or there is no such table in the database
+                pass
+
+    def create_tables(self, *models):
+        """
+        creates tables added after the existing databases were created,
+        called by the class that uses them, so every database only gets
+        the tables it needs
+        """
+        for model in models:
+            try:
+                model.__table__.create(self.engine, checkfirst=True)
+            except (OperationalError, ProgrammingError):
+                # created by another process at the same time
+                pass
 
     def create_session(self) -> Session:
         return self.factory()
+
+    @contextmanager
+    def session(self) -> Session:
+        """
+        session that is closed at the end of the with block and rolled back
+        after an exception, changes are committed by the caller
+        """
+        start = perf_counter()
+        session = self.factory()
+        try:
+            session.connection()
+            self.monitor.record_wait(perf_counter() - start)
+            yield session
+        except BaseException:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def stats(self):
+        return self.monitor.stats()
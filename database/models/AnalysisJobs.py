@@ -0,0 +1,17 @@
+from sqlalchemy import Column, Integer, String, Float
+
+
+def analysis_jobs(base):
+    class AnalysisJobs(base):
+        __tablename__ = 'AnalysisJobs'
+
+        id = Column(Integer, primary_key=True, autoincrement=True)
+        user_id = Column(Integer, index=True)
+        state = Column(String, index=True)
+        attempts = Column(Integer, default=0)
+        worker = Column(String, nullable=True)
+        error = Column(String, nullable=True)
+        created = Column(Float)
+        started = Column(Float, nullable=True)
+        finished = Column(Float, nullable=True)
+    return AnalysisJobs
@@ -0,0 +1,15 @@
+from sqlalchemy import Column, Integer, String
+
+
+def group_posts(base):
+    class GroupPosts(base):
+        __tablename__ = 'GroupPosts'
+
+        group_id = Column(Integer, primary_key=True)
+        post_id = Column(Integer, primary_key=True)
+        # place of the post on the wall, the pinned post is the first
+        position = Column(Integer)
+        text = Column(String)
+        marked_as_ads = Column(Integer)
+        date = Column(Integer)
+    return GroupPosts
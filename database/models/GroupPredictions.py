@@ -0,0 +1,14 @@
+from sqlalchemy import Column, Integer, String, Float
+
+
+def group_predictions(base):
+    class GroupPredictions(base):
+        __tablename__ = 'GroupPredictions'
+
+        group_id = Column(Integer, primary_key=True)
+        model_name = Column(String, primary_key=True)
+        post_id = Column(Integer)
+        scores = Column(String)
+        updated = Column(Float)
+        used = Column(Float, index=True)
+    return GroupPredictions
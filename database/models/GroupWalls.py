@@ -0,0 +1,12 @@
+from sqlalchemy import Column, Integer, Float
+
+
+def group_walls(base):
+    class GroupWalls(base):
+        __tablename__ = 'GroupWalls'
+
+        group_id = Column(Integer, primary_key=True)
+        post_count = Column(Integer)
+        error_code = Column(Integer, nullable=True)
+        fetched = Column(Float, index=True)
+    return GroupWalls
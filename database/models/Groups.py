@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, Integer, String, Index
 
 
 def groups(base):
@@ -9,4 +9,8 @@ def groups(base):
         name = Column(String)
         subject = Column(String)
         link = Column(String)
+
+        # recommendations are read page by page for a subject
+        __table_args__ = (Index('ix_Groups_subject_group_id',
+                                'subject', 'group_id'),)
     return Groups
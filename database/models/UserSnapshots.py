@@ -0,0 +1,14 @@
+from sqlalchemy import Column, Integer, String, Float
+
+
+def user_snapshots(base):
+    class UserSnapshots(base):
+        __tablename__ = 'UserSnapshots'
+
+        user_id = Column(Integer, primary_key=True)
+        model_name = Column(String)
+        subscriptions = Column(String)
+        group_ids = Column(String)
+        scores = Column(String)
+        updated = Column(Float)
+    return UserSnapshots
@@ -1 +1,2 @@
-from . import UserStatuses, GroupsIds, Groups
+from . import (UserStatuses, GroupsIds, Groups, GroupPredictions, GroupWalls,
+               GroupPosts, AnalysisJobs, UserSnapshots)
@@ -0,0 +1,72 @@
+import threading
+from time import time
+from sqlalchemy import event
+
+
+class PoolMonitor:
+    """
+    Connections of the engine pool: how long sessions wait for a connection,
+    how many connections are in use, and connections checked out for more
+    than leak_timeout seconds, which are reported once as leaked.
+    """
+
+    def __init__(self, engine, leak_timeout=60):
+        self.engine = engine
+        self.leak_timeout = leak_timeout
+        # id of the connection record -> (checkout time, thread name)
+        self.checked_out = {}
+        self.reported = set()
+        self.lock = threading.Lock()
+
+        self.counters = {'checkouts': 0, 'sessions': 0, 'wait_time': 0.,
+                         'max_wait': 0., 'leaked': 0}
+        event.listen(engine, 'checkout', self.on_checkout)
+        event.listen(engine, 'checkin', self.on_checkin)
+
+    def on_checkout(self, dbapi_connection, connection_record,
+                    connection_proxy):
+        with self.lock:
+            self.checked_out[id(connection_record)] = (
+                time(), threading.current_thread().name)
+            self.counters['checkouts'] += 1
+        self.check_leaks()
+
+    def on_checkin(self, dbapi_connection, connection_record):
+        with self.lock:
+            self.checked_out.pop(id(connection_record), None)
+            self.reported.discard(id(connection_record))
+
+    def record_wait(self, seconds):
+        with self.lock:
+            self.counters['sessions'] += 1
+            self.counters['wait_time'] += seconds
+            self.counters['max_wait'] = max(self.counters['max_wait'],
+                                            seconds)
+
+    def check_leaks(self):
+        """prints a warning for every connection that has just leaked"""
+        now = time()
+        with self.lock:
+            leaked = [(key, since, thread)
+                      for key, (since, thread) in self.checked_out.items()
+                      if now - since > self.leak_timeout and
+                      key not in self.reported]
+            self.reported.update(key for key, _, _ in leaked)
+            self.counters['leaked'] += len(leaked)
+        for _, since, thread in leaked:
+            print(f'WARNING: a connection to {self.engine.url.database} is '
+                  f'checked out by thread {thread} for {now - since:.0f} s, '
+                  f'a session may not be closed')
+
+    def stats(self):
+        self.check_leaks()
+        pool = self.engine.pool
+        with self.lock:
+            stats = dict(self.counters)
+            stats['in_use'] = len(self.checked_out)
+        stats['average_wait'] = (stats.pop('wait_time') / stats['sessions']
+                                 if stats['sessions'] else 0)
+        if hasattr(pool, 'overflow'):
+            stats['pool_size'] = pool.size()
+            stats['overflow'] = max(pool.overflow(), 0)
+        return stats
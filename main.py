@@ -1,19 +1,35 @@
 import os
+import sys
+import signal
 from time import sleep
 from traceback import format_exc
 from requests.exceptions import ReadTimeout, ConnectionError
 from web import Bot
+from web.sharding import ShardedListener
 from database.db_session import DataBase
 
 
-def start_bot():
+def make_bot():
     users_db = DataBase(os.environ.get('DATABASE_URL'))
     groups_db = DataBase(
         'sqlite:///database/db.sqlite?check_same_thread=false')
-    log_dir = "https://dashboard.heroku.com/apps/vk-recommend/logs"
     model_name = os.environ.get("MODEL_NAME", 'vk_not_filtered')
+    return Bot(users_db, groups_db, model_name)
 
-    bot = Bot(users_db, groups_db, model_name)
+
+def start_bot():
+    log_dir = "https://dashboard.heroku.com/apps/vk-recommend/logs"
+    # dynos are stopped with SIGTERM, exiting runs the atexit handlers that
+    # write the cached user statuses
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+
+    # with SHARDS this process only listens and the bots run in
+    # SHARDS worker processes
+    shards = int(os.environ.get('SHARDS', 0))
+    if shards:
+        bot = ShardedListener(make_bot, shards)
+    else:
+        bot = make_bot()
     if os.environ.get('IS_DEPLOY'):
         while True:
             try:
@@ -0,0 +1,154 @@
+import queue
+import threading
+from time import monotonic
+
+
+class _Request:
+    __slots__ = ('texts', 'created', 'done', 'result', 'error')
+
+    def __init__(self, texts):
+        self.texts = texts
+        self.created = monotonic()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class BatchPredictor:
+    """
+    Wraps Predictor so that text lists from concurrent callers are
+    predicted with one model call. Texts are cleaned in the caller's thread,
+    the model itself is only used by the batching thread.
+
+    A batch is run when it holds max_batch_size texts or when its oldest
+    request has waited max_wait seconds.
+    """
+
+    def __init__(self, predictor, max_batch_size=512, max_wait=0.05):
+        self.predictor = predictor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self.queue = queue.Queue()
+        self.counters = {
+            'batches': 0,
+            'requests': 0,
+            'texts': 0,
+            'max_batch_size': 0,
+            'queue_wait': 0.,
+            'max_queue_wait': 0.,
+            'model_time': 0.,
+        }
+        self.counters_lock = threading.Lock()
+
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    @property
+    def model_name(self):
+        return self.predictor.model_name
+
+    @property
+    def class_names(self):
+        return self.predictor.class_names
+
+    @property
+    def cleaner(self):
+        return self.predictor.cleaner
+
+    @property
+    def model(self):
+        return self.predictor.model
+
+    def predict(self, text_list):
+        """same as Predictor.predict"""
+        if not text_list or text_list == ['']:
+            return None
+        return self.predictor.rank(self.predict_texts(text_list))
+
+    def rank(self, prediction_result):
+        """same as Predictor.rank"""
+        return self.predictor.rank(prediction_result)
+
+    def predict_texts(self, text_list):
+        """same as Predictor.predict_texts"""
+        request = _Request(self.predictor.clean(text_list))
+        self.queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def close(self):
+        """stops the batching thread after the queued requests are done"""
+        self.queue.put(None)
+        self.thread.join()
+
+    def stats(self):
+        with self.counters_lock:
+            stats = dict(self.counters)
+        batches = stats['batches'] or 1
+        stats['avg_batch_size'] = stats['texts'] / batches
+        stats['avg_queue_wait'] = stats['queue_wait'] / (
+                stats['requests'] or 1)
+        stats['avg_model_time'] = stats['model_time'] / batches
+        return stats
+
+    def _loop(self):
+        pending = None
+        stopping = False
+        while not stopping:
+            request = pending or self.queue.get()
+            pending = None
+            if request is None:
+                return
+
+            batch = [request]
+            size = len(request.texts)
+            deadline = request.created + self.max_wait
+            while size < self.max_batch_size:
+                try:
+                    request = self.queue.get(
+                        timeout=max(0., deadline - monotonic()))
+                except queue.Empty:
+                    break
+                if request is None:
+                    stopping = True
+                    break
+                if size + len(request.texts) > self.max_batch_size:
+                    pending = request
+                    break
+                batch.append(request)
+                size += len(request.texts)
+
+            self._run(batch)
+
+    def _run(self, batch):
+        texts = [text for request in batch for text in request.texts]
+        started = monotonic()
+        try:
+            result = self.predictor.model.predict(texts)
+        except Exception as e:
+            for request in batch:
+                request.error = e
+                request.done.set()
+            return
+        model_time = monotonic() - started
+
+        start = 0
+        for request in batch:
+            request.result = result[start:start + len(request.texts)]
+            start += len(request.texts)
+            request.done.set()
+
+        waits = [started - request.created for request in batch]
+        with self.counters_lock:
+            self.counters['batches'] += 1
+            self.counters['requests'] += len(batch)
+            self.counters['texts'] += len(texts)
+            self.counters['max_batch_size'] = max(
+                self.counters['max_batch_size'], len(texts))
+            self.counters['queue_wait'] += sum(waits)
+            self.counters['max_queue_wait'] = max(
+                self.counters['max_queue_wait'], *waits)
+            self.counters['model_time'] += model_time
@@ -1,18 +1,137 @@
+import os
 import re
+import threading
+import multiprocessing
 import pymorphy2
+from collections import OrderedDict, deque
+from itertools import islice, chain
+from model.numpy_model import STRIP_PUNCTUATION
+
+LINKS = re.compile(r'http\S+')
+PUNCTUATION = re.compile(r'[^\w\s]')
 
 
 class Cleaner:
-    def __init__(self):
+    def __init__(self, cache_size=100000):
+        """
+        :param cache_size: how many word -> normal form pairs are kept,
+        the least recently used pair is evicted first; 0 disables the cache
+        """
         self.ma = pymorphy2.MorphAnalyzer()
 
-    def clean_text(self, text):
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def clean_text(self, text, max_tokens=None):
+        """
+        :param text: raw text
+        :param max_tokens: stop lemmatizing after this number of words,
+        the result is the same as the first max_tokens words of full cleaning
+        :return: space separated normal forms longer than 3 letters,
+        without words the model's standardization makes empty ('____'),
+        so max_tokens counts the words the model gets
+        """
         text = text.replace('\\', ' ').replace('╚', ' ').replace('╩', ' ')
         text = text.lower()
-        text = re.sub(r'http\S+', '', text)
-        text = re.sub(r'[^\w\s]', ' ', text)
-        text = ' '.join(self.ma.parse(word)[0].normal_form
-                        for word in text.split())
-        text = ' '.join(word for word in text.split() if len(word) > 3)
+        text = LINKS.sub('', text)
+        text = PUNCTUATION.sub(' ', text)
+        words = (normal_form
+                 for word in text.split()
+                 for normal_form in self.normal_form(word).split()
+                 if len(normal_form) > 3 and
+                 STRIP_PUNCTUATION.sub('', normal_form))
+        if max_tokens is not None:
+            words = islice(words, max_tokens)
+
+        return ' '.join(words)
+
+    def clean_batch(self, texts, workers=None, chunksize=64, max_tokens=None,
+                    min_parallel=1000, max_pending=None):
+        """
+        cleans texts in a pool of processes, every process has its own
+        Cleaner. Yields results in the order of texts as soon as they are
+        ready. Less than min_parallel texts are cleaned in this process.
+
+        :param texts: iterable of raw texts
+        :param workers: number of processes, os.cpu_count() by default
+        :param chunksize: number of texts sent to a process at once
+        :param max_tokens: same as in clean_text
+        :param min_parallel: smallest number of texts worth starting a pool
+        :param max_pending: number of chunks sent to the processes before
+        their results are taken, texts are read as fast as the pool takes
+        them by default
+        """
+        workers = workers or os.cpu_count()
+        texts = iter(texts)
+        head = list(islice(texts, min_parallel))
+
+        if workers <= 1 or len(head) < min_parallel:
+            for text in chain(head, texts):
+                yield self.clean_text(text, max_tokens)
+            return
+
+        with multiprocessing.Pool(workers, _init_worker,
+                                  (self.cache_size, max_tokens)) as pool:
+            texts = chain(head, texts)
+            if max_pending is None:
+                yield from pool.imap(_clean_in_worker, texts, chunksize)
+                return
+            pending = deque()
+            while True:
+                while len(pending) < max_pending:
+                    chunk = list(islice(texts, chunksize))
+                    if not chunk:
+                        break
+                    pending.append(pool.map_async(_clean_in_worker, chunk,
+                                                  chunksize))
+                if not pending:
+                    return
+                yield from pending.popleft().get()
+
+    def normal_form(self, word):
+        with self.cache_lock:
+            normal_form = self.cache.get(word)
+            if normal_form is not None:
+                self.cache.move_to_end(word)
+                self.hits += 1
+                return normal_form
+            self.misses += 1
+
+        normal_form = self.ma.parse(word)[0].normal_form
+
+        if self.cache_size:
+            with self.cache_lock:
+                self.cache[word] = normal_form
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+                    self.evictions += 1
+        return normal_form
+
+    def stats(self):
+        with self.cache_lock:
+            requests = self.hits + self.misses
+            return {
+                'cache_size': len(self.cache),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / requests if requests else 0.,
+            }
+
+
+_worker_cleaner = None
+_worker_max_tokens = None
+
+
+def _init_worker(cache_size, max_tokens):
+    global _worker_cleaner, _worker_max_tokens
+    _worker_cleaner = Cleaner(cache_size)
+    _worker_max_tokens = max_tokens
+
 
-        return text
+def _clean_in_worker(text):
+    return _worker_cleaner.clean_text(text, _worker_max_tokens)
@@ -0,0 +1,53 @@
+import threading
+import numpy as np
+
+
+def label_scores(class_index, class_count, smoothing=0.1):
+    """
+    return log-probabilities of the label smoothed by smoothing, they are
+    summed with model output (logits) like a confident prediction
+    """
+    probabilities = np.full(class_count, smoothing / class_count)
+    probabilities[class_index] += 1 - smoothing
+    return np.log(probabilities).tolist()
+
+
+class KnownGroups:
+    """
+    Groups whose subject was assigned by people (the Groups table, then
+    the GroupsIds imported from the csv), their labels are used instead of
+    the model output. Subjects are read from
+    catalog (see web.catalog).
+    """
+
+    def __init__(self, catalog, smoothing=0.1):
+        self.catalog = catalog
+        self.smoothing = smoothing
+
+        self.counters = {'known': 0, 'unknown': 0}
+        self.counters_lock = threading.Lock()
+
+    def scores(self, group_ids, class_names):
+        """
+        return {group_id: label scores} for the groups with a subject that
+        is one of class_names
+        """
+        if not group_ids:
+            return {}
+        subjects = self.catalog.subjects(group_ids)
+
+        classes = {name: i for i, name in enumerate(class_names)}
+        known = {}
+        for group_id, subject in subjects.items():
+            class_index = classes.get((subject or '').lower())
+            if class_index is not None:
+                known[group_id] = label_scores(class_index, len(class_names),
+                                               self.smoothing)
+        with self.counters_lock:
+            self.counters['known'] += len(known)
+            self.counters['unknown'] += len(set(group_ids)) - len(known)
+        return known
+
+    def stats(self):
+        with self.counters_lock:
+            return dict(self.counters)
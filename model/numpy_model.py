@@ -0,0 +1,85 @@
+import re
+import numpy as np
+
+# Same as TextVectorization's 'lower_and_strip_punctuation' standardization
+STRIP_PUNCTUATION = re.compile(r'[!"#$%&()\*\+,-\./:;<=>?@\[\\\]^_`{|}~\']')
+# TextVectorization splits on ASCII whitespace only
+WHITESPACE = re.compile(r'[ \t\n\r\v\f]+')
+
+PAD_INDEX = 0
+OOV_INDEX = 1
+
+
+class NumpyModel:
+    """
+    inference-only copy of the Keras model from Predictor:
+    TextVectorization -> Embedding -> GlobalAveragePooling1D -> Dense.
+    Dropout layers are no-ops at inference and are skipped.
+
+    The embedding may be int8 with a float scale for every row
+    (see utils.compress_model)
+    """
+
+    def __init__(self, vocabulary, embedding, kernel, bias, sequence_length,
+                 scales=None):
+        self.vocabulary = list(vocabulary)
+        self.index = {word: i for i, word in enumerate(self.vocabulary)
+                      if i > OOV_INDEX}
+        self.embedding = embedding
+        self.scales = scales
+        self.kernel = kernel
+        self.bias = bias
+        self.sequence_length = int(sequence_length)
+
+    @classmethod
+    def load(cls, path):
+        """load model exported by utils.export_model"""
+        with np.load(path, allow_pickle=False) as data:
+            return cls(vocabulary=data['vocabulary'].tolist(),
+                       embedding=data['embedding'],
+                       kernel=data['kernel'],
+                       bias=data['bias'],
+                       sequence_length=data['sequence_length'],
+                       scales=data['scales'] if 'scales' in data else None)
+
+    def save(self, path):
+        arrays = {}
+        if self.scales is not None:
+            arrays['scales'] = self.scales
+        np.savez(path,
+                 vocabulary=np.array(self.vocabulary),
+                 embedding=self.embedding,
+                 kernel=self.kernel,
+                 bias=self.bias,
+                 sequence_length=np.array(self.sequence_length),
+                 **arrays)
+
+    def tokenize(self, text):
+        text = STRIP_PUNCTUATION.sub('', text.lower())
+        return [word for word in WHITESPACE.split(text) if word]
+
+    def vectorize(self, text_list):
+        """return (len(text_list), sequence_length) matrix of token ids"""
+        ids = np.full((len(text_list), self.sequence_length), PAD_INDEX,
+                      dtype=np.int64)
+        for row, text in zip(ids, text_list):
+            tokens = self.tokenize(text)[:self.sequence_length]
+            row[:len(tokens)] = [self.index.get(word, OOV_INDEX)
+                                 for word in tokens]
+        return ids
+
+    def predict(self, text_list):
+        """return (len(text_list), class count) matrix of logits"""
+        ids = self.vectorize(text_list)
+        if self.scales is None:
+            vectors = self.embedding[ids]
+        else:
+            vectors = (self.embedding[ids].astype(np.float32) *
+                       self.scales[ids][..., np.newaxis])
+        return vectors.mean(axis=1) @ self.kernel + self.bias
+
+    @property
+    def nbytes(self):
+        return (self.embedding.nbytes + self.kernel.nbytes +
+                self.bias.nbytes +
+                (self.scales.nbytes if self.scales is not None else 0))
@@ -0,0 +1,172 @@
+import threading
+from time import time
+from collections import namedtuple
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+CachedPrediction = namedtuple('CachedPrediction',
+                              ['post_id', 'scores', 'fresh'])
+
+
+class PredictionCache:
+    """
+    Output of every model for every VK group stored in the GroupPredictions
+    table.
+    A row is fresh for ttl seconds; after that it is still valid as long as
+    the newest post of the group is the same. Least recently used rows are
+    deleted when there are more than max_size of them.
+    """
+
+    def __init__(self, db, ttl=24 * 60 * 60, max_size=100000,
+                 used_batch=1000):
+        """
+        :param used_batch: number of read rows whose last use time is kept
+        in memory before it is written, it is also written by put
+        """
+        self.db = db
+        db.create_tables(db.GroupPredictions)
+        self.ttl = ttl
+        self.max_size = max_size
+        self.used_batch = used_batch
+
+        # (model_name, group_id) -> time of the last read not written yet
+        self.used = {}
+        self.used_lock = threading.Lock()
+        # rows in the table, counted again when it exceeds max_size
+        self.size = None
+
+        self.counters = {'fresh': 0, 'revalidated': 0, 'predicted': 0}
+        self.counters_lock = threading.Lock()
+
+    def get(self, model_name, group_ids):
+        """return {group_id: CachedPrediction} for cached groups"""
+        if not group_ids:
+            return {}
+        table = self.db.GroupPredictions
+        try:
+            with self.db.session() as session:
+                rows = session.query(
+                    table.group_id, table.post_id, table.scores,
+                    table.updated).filter(
+                    table.model_name == model_name,
+                    table.group_id.in_(group_ids)).all()
+        except OperationalError as e:
+            # the groups are predicted again
+            print(f'Predictions are not read from the cache: {e.orig}')
+            return {}
+
+        now = time()
+        cached = {}
+        for group_id, post_id, scores, updated in rows:
+            cached[group_id] = CachedPrediction(
+                post_id, [float(score) for score in scores.split(',')],
+                now - updated < self.ttl)
+        with self.used_lock:
+            for group_id in cached:
+                self.used[model_name, group_id] = now
+            full = len(self.used) >= self.used_batch
+        if full:
+            self.write_used()
+        return cached
+
+    def write_used(self):
+        """writes the last use time of the rows read since the last write"""
+        with self.used_lock:
+            used, self.used = self.used, {}
+        if not used:
+            return
+        table = self.db.GroupPredictions
+        try:
+            with self.db.session() as session:
+                session.bulk_update_mappings(table, [
+                    {'model_name': model_name, 'group_id': group_id,
+                     'used': time_used}
+                    for (model_name, group_id), time_used in used.items()])
+                session.commit()
+        except OperationalError as e:
+            # written with the next batch
+            with self.used_lock:
+                self.used = {**used, **self.used}
+            print(f'Use time of predictions is not written: {e.orig}')
+
+    def put(self, model_name, predictions):
+        """
+        :param model_name: name of the model that made the predictions
+        :param predictions: {group_id: (newest post id, model output row)}
+        """
+        if not predictions:
+            return
+        self.write_used()
+        table = self.db.GroupPredictions
+        now = time()
+        rows = {group_id: {'group_id': group_id,
+                           'model_name': model_name,
+                           'post_id': post_id,
+                           'scores': ','.join(str(float(score))
+                                              for score in scores),
+                           'updated': now,
+                           'used': now}
+                for group_id, (post_id, scores) in predictions.items()}
+        with self.db.session() as session:
+            for attempt in range(3):
+                try:
+                    existing = {group_id for group_id, in session.query(
+                        table.group_id).filter(
+                        table.model_name == model_name,
+                        table.group_id.in_(list(rows)))}
+                    session.bulk_update_mappings(
+                        table, [row for group_id, row in rows.items()
+                                if group_id in existing])
+                    session.bulk_insert_mappings(
+                        table, [row for group_id, row in rows.items()
+                                if group_id not in existing])
+                    session.commit()
+                    break
+                except IntegrityError:
+                    # another analysis has inserted some of the groups
+                    session.rollback()
+                except OperationalError as e:
+                    # the database is locked by other writers for too long
+                    session.rollback()
+                    print(f'Predictions are not cached: {e.orig}')
+                    return
+            else:
+                return
+
+            try:
+                self.trim(session, len(rows) - len(existing))
+            except OperationalError as e:
+                session.rollback()
+                print(f'Predictions are not trimmed: {e.orig}')
+
+    def trim(self, session, inserted):
+        """
+        deletes the least recently used rows over max_size, the rows are
+        counted once and then only when the estimate is over max_size
+        """
+        table = self.db.GroupPredictions
+        if self.size is None:
+            self.size = session.query(table).count()
+        else:
+            self.size += inserted
+        if self.size <= self.max_size:
+            return
+        # other processes and threads add rows too
+        self.size = session.query(table).count()
+        if self.size <= self.max_size:
+            return
+        oldest = session.query(table.used).order_by(
+            table.used.desc()).offset(self.max_size).first()
+        if oldest is not None:
+            session.query(table).filter(table.used < oldest[0]).delete(
+                synchronize_session=False)
+            session.commit()
+        self.size = session.query(table).count()
+
+    def count(self, **counters):
+        with self.counters_lock:
+            for key, value in counters.items():
+                self.counters[key] += value
+
+    def stats(self):
+        with self.counters_lock:
+            return dict(self.counters)
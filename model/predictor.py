@@ -1,58 +1,125 @@
+import os
 from operator import itemgetter
-from tensorflow.keras import Sequential, layers
-from tensorflow.keras.layers.experimental.preprocessing import\
-    TextVectorization
 
 from model.cleaner import Cleaner
+from model.numpy_model import NumpyModel
+
+INFERENCE_FILE = 'inference.npz'
+COMPACT_INFERENCE_FILE = 'inference_compact.npz'
 
 
 class Predictor:
-    def __init__(self, model_name):
-        with open(f'models/{model_name}/class_names.txt',
+    def __init__(self, model_name, backend='auto', models_dir='models'):
+        """
+        :param model_name: directory name in models_dir
+        :param backend: 'keras' (needs tensorflow), 'numpy' (needs
+        models/{model_name}/inference.npz made by utils.export_model),
+        'compact' (needs models/{model_name}/inference_compact.npz made by
+        utils.compress_model) or 'auto' to use the first one of
+        compact, numpy and keras whose files exist
+        :param models_dir: directory with models
+        """
+        self.model_dir = f'{models_dir}/{model_name}'
+        with open(f'{self.model_dir}/class_names.txt',
                   'r', encoding='utf-8') as f:
             self.class_names = f.readline().rstrip().split(',')
 
         self.cleaner = Cleaner()
 
+        self.model_name = model_name
+        self.backend = None
+        self.sequence_length = None
         self.model = None
-        self.load_model(model_name)
+        self.load_model(model_name, backend)
 
     def predict(self, text_list):
         """return list of class predictions based on list of strings"""
         if not text_list or text_list == ['']:
             return None
-        text_list = [self.cleaner.clean_text(text) for text in text_list]
-        prediction_result = self.model.predict(text_list)
+        return self.rank(self.predict_texts(text_list))
+
+    def predict_texts(self, text_list):
+        """return model output (a row of class scores) for every string"""
+        return self.model.predict(self.clean(text_list))
+
+    def clean(self, text_list):
+        # the model only looks at the first sequence_length words
+        return list(self.cleaner.clean_batch(
+            text_list, max_tokens=self.sequence_length))
+
+    def rank(self, prediction_result):
+        """return classes sorted by the sum of their scores over all rows"""
         probabilities = [(key, sum(map(itemgetter(i), prediction_result)))
                          for i, key in enumerate(self.class_names)]
         return sorted(probabilities, key=itemgetter(1), reverse=True)
 
-    def load_model(self, model_name):
-        try:
-            with open(f'models/{model_name}/params.txt', 'r') as f:
-                max_features = int(f.readline())
-                sequence_length = int(f.readline())
-                embedding_dim = int(f.readline())
-        except FileNotFoundError:
-            max_features = 20000
-            sequence_length = 40
-            embedding_dim = 160
-
-        vectorize_layer = TextVectorization(
-            max_tokens=max_features,
-            output_mode='int',
-            output_sequence_length=sequence_length)
-
-        # ATTENTION: this model MUST be absolutely
-        # identical to the original one
-        self.model = Sequential([vectorize_layer, Sequential([
-            layers.Embedding(max_features + 1, embedding_dim),
-            layers.Dropout(0.3),
-            layers.GlobalAveragePooling1D(),
-            layers.Dropout(0.3),
-            layers.Dense(len(self.class_names))])])
-        self.model.load_weights(f'models/{model_name}/checkpoint')
-        self.model.predict(["define", "input", "shape"])
+    def load_model(self, model_name, backend='auto'):
+        max_features, sequence_length, embedding_dim = read_params(
+            model_name, self.model_dir)
+        self.sequence_length = sequence_length
+
+        inference_path = f'{self.model_dir}/{INFERENCE_FILE}'
+        compact_path = f'{self.model_dir}/{COMPACT_INFERENCE_FILE}'
+        if backend == 'auto':
+            if os.path.exists(compact_path):
+                backend = 'compact'
+            elif os.path.exists(inference_path):
+                backend = 'numpy'
+            else:
+                backend = 'keras'
+
+        if backend == 'numpy':
+            self.model = NumpyModel.load(inference_path)
+        elif backend == 'compact':
+            self.model = NumpyModel.load(compact_path)
+        elif backend == 'keras':
+            self.model = build_keras_model(self.model_dir,
+                                           len(self.class_names),
+                                           max_features, sequence_length,
+                                           embedding_dim)
+        else:
+            raise ValueError(f'Unknown backend {backend}')
+        self.backend = backend
+
+
+def read_params(model_name, model_dir=None):
+    """return max_features, sequence_length, embedding_dim of the model"""
+    model_dir = model_dir or f'models/{model_name}'
+    try:
+        with open(f'{model_dir}/params.txt', 'r') as f:
+            max_features = int(f.readline())
+            sequence_length = int(f.readline())
+            embedding_dim = int(f.readline())
+    except FileNotFoundError:
+        max_features = 20000
+        sequence_length = 40
+        embedding_dim = 160
+    return max_features, sequence_length, embedding_dim
+
+
+def build_keras_model(model_dir, class_count,
+                      max_features, sequence_length, embedding_dim):
+    # tensorflow is imported here so that the numpy backend works without it
+    from tensorflow.keras import Sequential, layers
+    from tensorflow.keras.layers.experimental.preprocessing import\
+        TextVectorization
+
+    vectorize_layer = TextVectorization(
+        max_tokens=max_features,
+        output_mode='int',
+        output_sequence_length=sequence_length)
+
+    # ATTENTION: this model MUST be absolutely
+    # identical to the original one
+    model = Sequential([vectorize_layer, Sequential([
+        layers.Embedding(max_features + 1, embedding_dim),
+        layers.Dropout(0.3),
+        layers.GlobalAveragePooling1D(),
+        layers.Dropout(0.3),
+        layers.Dense(class_count)])])
+    model.load_weights(f'{model_dir}/checkpoint')
+    model.predict(["define", "input", "shape"])
+    return model
 
 
 if __name__ == '__main__':
@@ -0,0 +1,65 @@
+import numpy as np
+
+
+class ProgressiveRanking:
+    """
+    Running totals of class scores of the groups predicted chunk by chunk.
+    The ranking is stable when the top classes have not changed for
+    stable_chunks chunks in a row and the gap between the last top class
+    and the next one is at least margin of the gap between the best and
+    the worst class.
+    """
+
+    def __init__(self, class_names, top=3, stable_chunks=2, margin=0.05):
+        self.class_names = class_names
+        self.top = top
+        self.stable_chunks = stable_chunks
+        self.margin = margin
+
+        self.totals = np.zeros(len(class_names))
+        self.rows = 0
+        self.chunks = 0
+        self.unchanged = 0
+        self.last_top = None
+
+    def update(self, rows):
+        """adds model output rows of a chunk, return the current top"""
+        if len(rows):
+            self.totals += np.asarray(rows, dtype=float).sum(axis=0)
+            self.rows += len(rows)
+        self.chunks += 1
+
+        top = set(self.ranking()[:self.top])
+        if top == self.last_top and self.confidence() >= self.margin:
+            self.unchanged += 1
+        else:
+            self.unchanged = 0
+        self.last_top = top
+        return self.result()
+
+    def ranking(self):
+        """return class indexes from the highest total score"""
+        return list(np.argsort(-self.totals, kind='stable'))
+
+    def confidence(self):
+        """return gap after the top classes relative to the whole spread"""
+        if not self.rows or len(self.totals) <= self.top:
+            return 0.
+        scores = np.sort(self.totals)[::-1]
+        spread = scores[0] - scores[-1]
+        if spread <= 0:
+            return 0.
+        return float((scores[self.top - 1] - scores[self.top]) / spread)
+
+    def result(self):
+        """return names of the top classes"""
+        return [self.class_names[i] for i in self.ranking()[:self.top]]
+
+    @property
+    def stable(self):
+        return self.unchanged >= self.stable_chunks
+
+    @property
+    def may_stop(self):
+        """whether the next chunk can make the ranking stable"""
+        return self.unchanged + 1 >= self.stable_chunks
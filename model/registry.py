@@ -0,0 +1,176 @@
+import os
+import threading
+from time import time, monotonic, sleep
+from contextlib import contextmanager
+
+from model.predictor import Predictor
+
+
+def resident_memory():
+    """return resident set size of this process in bytes (Linux only)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+class _Entry:
+    __slots__ = ('predictor', 'load_time', 'size', 'weights_size',
+                 'last_used', 'users')
+
+    def __init__(self, predictor, load_time, size, weights_size):
+        self.predictor = predictor
+        self.load_time = load_time
+        self.size = size
+        self.weights_size = weights_size
+        self.last_used = time()
+        self.users = 0
+
+
+class ModelRegistry:
+    """
+    Keeps the models from models/ that are in use. A model is loaded on the
+    first use, the active one can be switched while analyses are running:
+    they finish with the model they have started with. Models other than
+    the active one are unloaded after idle_timeout seconds without use.
+    """
+
+    def __init__(self, active, factory=None, models_dir='models',
+                 idle_timeout=600):
+        """
+        :param active: name of the model used by default
+        :param factory: makes a predictor from a model name,
+        Predictor by default
+        :param models_dir: directory with models
+        :param idle_timeout: seconds before an unused model is unloaded,
+        None or 0 to keep models loaded
+        """
+        self.models_dir = models_dir
+        self.factory = factory or (
+            lambda name: Predictor(name, models_dir=models_dir))
+        self.idle_timeout = idle_timeout
+
+        self.names = sorted(
+            name for name in os.listdir(models_dir)
+            if os.path.exists(f'{models_dir}/{name}/class_names.txt'))
+        if active not in self.names:
+            raise ValueError(f'Model {active} not found in {models_dir}')
+        self.active = active
+
+        self.models = {}
+        self.lock = threading.Lock()
+        self.load_locks = {name: threading.Lock() for name in self.names}
+
+        if idle_timeout is not None and idle_timeout > 0:
+            threading.Thread(target=self._unload_loop, daemon=True).start()
+
+    def get(self, name=None):
+        """return loaded predictor of the model (the active one by default)"""
+        name = name or self.active
+        with self.lock:
+            entry = self.models.get(name)
+        if entry is None:
+            entry = self._load(name)
+        entry.last_used = time()
+        return entry.predictor
+
+    @contextmanager
+    def use(self, name=None):
+        """
+        gives the predictor of the model (the active one by default) and
+        keeps it loaded until the end of the block
+        """
+        name = name or self.active
+        while True:
+            self.get(name)
+            with self.lock:
+                entry = self.models.get(name)
+                if entry is not None:
+                    entry.users += 1
+                    break
+        try:
+            yield entry.predictor
+        finally:
+            with self.lock:
+                entry.users -= 1
+                entry.last_used = time()
+
+    def activate(self, name):
+        """loads the model and makes it the default one"""
+        if name not in self.names:
+            raise ValueError(f'Model {name} not found in {self.models_dir}')
+        self.get(name)
+        self.active = name
+        print(f'*** model {name} activated')
+
+    def unload(self, name):
+        """unloads the model if it is not active and not in use"""
+        with self.lock:
+            entry = self.models.get(name)
+            if entry is None or name == self.active or entry.users:
+                return False
+            del self.models[name]
+        close = getattr(entry.predictor, 'close', None)
+        if close is not None:
+            close()
+        print(f'*** model {name} unloaded')
+        return True
+
+    def stats(self):
+        """return {model name: {loaded, active, load_time, size, ...}}"""
+        now = time()
+        with self.lock:
+            stats = {}
+            for name in self.names:
+                entry = self.models.get(name)
+                stats[name] = {'loaded': entry is not None,
+                               'active': name == self.active}
+                if entry is not None:
+                    stats[name].update({
+                        'load_time': entry.load_time,
+                        'size': entry.size,
+                        'weights_size': entry.weights_size,
+                        'idle': now - entry.last_used,
+                        'users': entry.users,
+                    })
+            return stats
+
+    def _load(self, name):
+        with self.load_locks[name]:
+            with self.lock:
+                entry = self.models.get(name)
+            if entry is not None:
+                return entry
+
+            print(f'*** loading model {name}')
+            memory = resident_memory()
+            started = monotonic()
+            predictor = self.factory(name)
+            load_time = monotonic() - started
+            size = (resident_memory() - memory
+                    if memory is not None else None)
+            entry = _Entry(predictor, load_time, size,
+                           weights_size(predictor.model))
+            print(f'*** model {name} loaded in {load_time:.2f}s')
+
+            with self.lock:
+                self.models[name] = entry
+            return entry
+
+    def _unload_loop(self):
+        while True:
+            sleep(max(self.idle_timeout / 2, 1))
+            now = time()
+            with self.lock:
+                idle = [name for name, entry in self.models.items()
+                        if now - entry.last_used > self.idle_timeout]
+            for name in idle:
+                self.unload(name)
+
+
+def weights_size(model):
+    """return size of the model weights in bytes"""
+    if hasattr(model, 'get_weights'):
+        return sum(weights.nbytes for weights in model.get_weights())
+    return model.nbytes
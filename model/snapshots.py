@@ -0,0 +1,88 @@
+import threading
+from time import time
+from collections import namedtuple
+from sqlalchemy.exc import OperationalError
+
+Snapshot = namedtuple('Snapshot', ['subscriptions', 'scores'])
+
+
+def join_ids(ids):
+    return ','.join(map(str, sorted(ids)))
+
+
+def split_ids(ids):
+    return {int(_id) for _id in ids.split(',') if _id}
+
+
+class SubscriptionSnapshots:
+    """
+    Subscriptions of every user at the last analysis and the class scores
+    of every scored group, stored in the UserSnapshots table, so a
+    re-analysis removes exactly the scores that were added. A snapshot is
+    used for ttl seconds and only by the same model; a re-analysis with
+    more than max_change of the subscriptions changed is made from scratch.
+    """
+
+    def __init__(self, db, ttl=7 * 24 * 60 * 60, max_change=0.5):
+        self.db = db
+        db.create_tables(db.UserSnapshots)
+        self.ttl = ttl
+        self.max_change = max_change
+
+        self.counters = {'full': 0, 'incremental': 0}
+        self.counters_lock = threading.Lock()
+
+    def get(self, user_id, model_name):
+        """return Snapshot of the user or None"""
+        table = self.db.UserSnapshots
+        with self.db.session() as session:
+            row = session.query(table).filter(
+                table.user_id == user_id).first()
+        if (row is None or row.model_name != model_name or
+                time() - row.updated >= self.ttl):
+            return None
+        group_ids = sorted(split_ids(row.group_ids))
+        rows = row.scores.split(';') if group_ids else []
+        return Snapshot(split_ids(row.subscriptions),
+                        {group_id: list(map(float, scores.split(',')))
+                         for group_id, scores in zip(group_ids, rows)})
+
+    def put(self, user_id, model_name, subscriptions, scores):
+        """
+        :param user_id: user ID
+        :param model_name: name of the model that made the scores
+        :param subscriptions: IDs of all the subscriptions
+        :param scores: {group_id: row of class scores} of the scored
+        subscriptions
+        """
+        table = self.db.UserSnapshots
+        # 9 digits keep float32 model output exact
+        rows = ';'.join(','.join(f'{float(score):.9g}'
+                                 for score in scores[group_id])
+                        for group_id in sorted(scores))
+        with self.db.session() as session:
+            try:
+                session.merge(table(user_id=user_id,
+                                    model_name=model_name,
+                                    subscriptions=join_ids(subscriptions),
+                                    group_ids=join_ids(scores),
+                                    scores=rows,
+                                    updated=time()))
+                session.commit()
+            except OperationalError as e:
+                # the next analysis is made from scratch
+                session.rollback()
+                print(f'Snapshot is not stored: {e.orig}')
+
+    def changed_too_much(self, snapshot, added, removed):
+        return (len(added) + len(removed) >
+                self.max_change * max(len(snapshot.subscriptions), 1))
+
+    def count(self, **counters):
+        with self.counters_lock:
+            for key, value in counters.items():
+                self.counters[key] += value
+
+    def stats(self):
+        with self.counters_lock:
+            return dict(self.counters)
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('pymorphy2')
+
+from model.cleaner import Cleaner
+from model.numpy_model import NumpyModel
+
+TEXTS = [
+    'физика ' * 3 + '______ ' * 5 + 'химия ' * 40,
+    'Новости __ школы: олимпиада_по_физике, https://vk.com/club1 '
+    'геометрия и алгебра ' * 10,
+    '╚═ Расписание ═╝ ' * 3 + 'математика ' * 20,
+]
+
+
+def model_for(texts, sequence_length):
+    """NumpyModel with every word of the texts in the vocabulary"""
+    tokenizer = NumpyModel([], None, None, None, sequence_length)
+    words = sorted({word for text in texts
+                    for word in tokenizer.tokenize(text)})
+    return NumpyModel(['', '[UNK]'] + words, None, None, None,
+                      sequence_length)
+
+
+@pytest.mark.parametrize('sequence_length', [5, 8, 40])
+def test_budget_vectorizes_as_full_cleaning(sequence_length):
+    cleaner = Cleaner()
+    full = [cleaner.clean_text(text) for text in TEXTS]
+    cut = [cleaner.clean_text(text, sequence_length) for text in TEXTS]
+    model = model_for(full, sequence_length)
+    np.testing.assert_array_equal(model.vectorize(cut),
+                                  model.vectorize(full))
+
+
+def test_budget_counts_model_tokens():
+    cleaner = Cleaner()
+    cut = cleaner.clean_text(TEXTS[0], 8)
+    assert NumpyModel([], None, None, None, 8).tokenize(cut) == \
+        cut.split()
+    assert len(cut.split()) == 8
+
+
+def test_bounded_batch_reads_texts_as_results_are_taken():
+    read = []
+
+    def texts():
+        for i in range(200):
+            read.append(i)
+            yield TEXTS[i % len(TEXTS)]
+
+    cleaner = Cleaner()
+    results = cleaner.clean_batch(texts(), workers=2, chunksize=4,
+                                  min_parallel=0, max_pending=3)
+    assert next(results) == cleaner.clean_text(TEXTS[0])
+    assert len(read) <= 3 * 4
+    rest = list(results)
+    assert rest == [cleaner.clean_text(TEXTS[i % len(TEXTS)])
+                    for i in range(1, 200)]
@@ -0,0 +1,79 @@
+import pytest
+
+from benchmarks.fake_vk import FakeVk, TOO_MANY_REQUESTS
+from web import wall_fetcher
+from web.wall_fetcher import WallFetcher, EXECUTE_LIMIT
+
+
+def make_walls(groups, posts_per_group=3):
+    return {group_id: [{'id': group_id * 100 + i, 'owner_id': -group_id,
+                        'text': f'post {i} of {group_id}',
+                        'marked_as_ads': int(i == 0)}
+                       for i in range(posts_per_group)]
+            for group_id in range(1, groups + 1)}
+
+
+@pytest.fixture
+def fake():
+    fake = FakeVk(walls=make_walls(60), closed_share=0, disabled_share=0)
+    fake.closed = {3}
+    fake.disabled = {7}
+    return fake
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(wall_fetcher, 'sleep', lambda seconds: None)
+
+
+def test_errors_are_mapped_per_group(fake):
+    walls, errors = WallFetcher(fake).fetch([1, 3, 7, 1000, 2], count=2)
+    assert sorted(walls) == [1, 2]
+    assert [post['id'] for post in walls[1]] == [100, 101]
+    assert sorted(errors) == [3, 7, 1000]
+    assert all(error['error_code'] == 15 for error in errors.values())
+
+
+def test_groups_are_split_into_execute_requests(fake):
+    group_ids = list(range(1, 61))
+    walls, errors = WallFetcher(fake, workers=2).fetch(group_ids)
+    assert len(walls) + len(errors) == 60
+    assert fake.calls['execute'] == -(-60 // EXECUTE_LIMIT)
+    assert fake.calls['wall.get'] == 0
+    assert fake.execute_calls['wall.get'] == 60
+
+
+def flaky(fake, failures):
+    """wall.get failing with error 6 failures[group_id] times"""
+    wall_get = fake.handlers['wall.get']
+
+    def handler(values):
+        group_id = -int(values['owner_id'])
+        if failures.get(group_id, 0) > 0:
+            failures[group_id] -= 1
+            return TOO_MANY_REQUESTS
+        return wall_get(values)
+    fake.handlers['wall.get'] = handler
+
+
+def test_rate_limited_calls_are_retried(fake):
+    flaky(fake, {1: 1, 2: 2})
+    walls, errors = WallFetcher(fake, retries=3).fetch([1, 2, 4])
+    assert sorted(walls) == [1, 2, 4]
+    assert errors == {}
+    # only the failed calls are sent again
+    assert fake.calls['execute'] == 3
+    assert fake.execute_calls['wall.get'] == 3 + 2 + 1
+
+
+def test_rate_limit_error_is_returned_after_retries(fake):
+    flaky(fake, {1: 10})
+    walls, errors = WallFetcher(fake, retries=2).fetch([1, 2])
+    assert sorted(walls) == [2]
+    assert errors[1]['error_code'] == TOO_MANY_REQUESTS['error_code']
+    assert fake.execute_calls['wall.get'] == 2 + 2
+
+
+def test_texts_skip_ads(fake):
+    texts = WallFetcher(fake).fetch_texts([1, 3])
+    assert texts == {1: 'post 1 of 1\npost 2 of 1'}
@@ -2,3 +2,5 @@ from .fill_groups_db_from_csv import *
 from .csv_dataset_from_db import *
 from .yandex_referats_to_ds import yandex_referats_to_ds
 from .train_model import train_model
+from .export_model import export_model
+from .compress_model import compress_model
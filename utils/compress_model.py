@@ -0,0 +1,115 @@
+import csv
+import numpy as np
+
+from model.numpy_model import NumpyModel, PAD_INDEX, OOV_INDEX
+from model.predictor import INFERENCE_FILE, COMPACT_INFERENCE_FILE
+
+
+def read_corpus(path):
+    """return texts from the first column of a dataset.csv-like file"""
+    with open(path, encoding='utf-8') as f:
+        return [row[0] for row in csv.reader(f) if row]
+
+
+def split_corpus(texts, holdout, seed=0):
+    """return the texts without a random holdout share and the held-out ones"""
+    order = np.random.default_rng(seed).permutation(len(texts))
+    held_out = int(len(texts) * holdout)
+    return ([texts[i] for i in order[held_out:]],
+            [texts[i] for i in order[:held_out]])
+
+
+def prune_vocabulary(model, texts, min_count=1):
+    """
+    return the model without the words met less than min_count times in
+    the first sequence_length words of the texts, such words become [UNK]
+    """
+    counts = np.bincount(model.vectorize(texts).ravel(),
+                         minlength=len(model.vocabulary))
+    keep = [PAD_INDEX, OOV_INDEX] + [
+        i for i in range(OOV_INDEX + 1, len(model.vocabulary))
+        if counts[i] >= min_count]
+    return NumpyModel(vocabulary=[model.vocabulary[i] for i in keep],
+                      embedding=model.embedding[keep],
+                      kernel=model.kernel,
+                      bias=model.bias,
+                      sequence_length=model.sequence_length)
+
+
+def quantize_embedding(model):
+    """return the model with int8 embedding and a float32 scale per row"""
+    embedding = model.embedding.astype(np.float32)
+    scales = np.abs(embedding).max(axis=1) / 127
+    scales[scales == 0] = 1
+    quantized = np.round(embedding / scales[:, np.newaxis]).astype(np.int8)
+    return NumpyModel(vocabulary=model.vocabulary,
+                      embedding=quantized,
+                      kernel=model.kernel,
+                      bias=model.bias,
+                      sequence_length=model.sequence_length,
+                      scales=scales.astype(np.float32))
+
+
+def agreement(original, compact, texts, top=(1, 3), group_size=None):
+    """
+    return {k: share of texts with the same top-k classes (as a set)};
+    with group_size, outputs of every group_size texts are summed first,
+    like the analysis sums the outputs of a user's groups
+    """
+    expected = original.predict(texts)
+    result = compact.predict(texts)
+    if group_size:
+        starts = np.arange(0, len(texts), group_size)
+        expected = np.add.reduceat(expected, starts)
+        result = np.add.reduceat(result, starts)
+    expected = np.argsort(-expected, axis=1)
+    result = np.argsort(-result, axis=1)
+    return {k: float(np.mean([set(a[:k]) == set(b[:k])
+                              for a, b in zip(expected, result)]))
+            for k in top}
+
+
+def compress_model(model_name, corpus='data/ds/dataset.csv',
+                   eval_corpus=None, holdout=0.1, min_count=1,
+                   group_size=100):
+    """
+    makes models/{model_name}/inference_compact.npz from inference.npz
+    (see utils.export_model): drops vocabulary rows not used by the corpus
+    and quantizes the embedding to int8. Reports how often the compact
+    model gives the same top-1/top-3 classes as the original one on
+    eval_corpus, or on a random holdout share of the corpus that is not
+    used for pruning, so the report includes the words lost by pruning
+    """
+    original = NumpyModel.load(f'models/{model_name}/{INFERENCE_FILE}')
+    texts = read_corpus(corpus)
+    if eval_corpus:
+        eval_texts = read_corpus(eval_corpus)
+    else:
+        texts, eval_texts = split_corpus(texts, holdout)
+    if not eval_texts:
+        raise ValueError('No texts to evaluate the compact model on')
+
+    pruned = prune_vocabulary(original, texts, min_count)
+    compact = quantize_embedding(pruned)
+    path = f'models/{model_name}/{COMPACT_INFERENCE_FILE}'
+    compact.save(path)
+
+    print(f'{model_name}: {len(original.vocabulary)} -> '
+          f'{len(compact.vocabulary)} words, embedding '
+          f'{original.embedding.shape} {original.embedding.dtype} -> '
+          f'{compact.embedding.shape} {compact.embedding.dtype}')
+    print(f'weights: {original.nbytes / 2 ** 20:.2f} MB -> '
+          f'{compact.nbytes / 2 ** 20:.2f} MB -> {path}')
+
+    report = {'texts': agreement(original, compact, eval_texts),
+              'groups': agreement(original, compact, eval_texts,
+                                  group_size=group_size),
+              'original_size': original.nbytes,
+              'compact_size': compact.nbytes}
+    groups = -(-len(eval_texts) // group_size)
+    for key, title in (('texts', f'{len(eval_texts)} texts'),
+                       ('groups', f'{groups} sums of {group_size} texts')):
+        print(f'agreement on {title}: ' +
+              ', '.join(f'top-{k} {share:.2%}'
+                        for k, share in report[key].items()))
+    return report
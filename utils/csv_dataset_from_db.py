@@ -1,55 +1,259 @@
 import os
 import csv
-import vk_api
+import json
+import queue
+import shutil
+import threading
+from collections import deque
 
 from model.cleaner import Cleaner
+from web.wall_fetcher import WallFetcher, EXECUTE_LIMIT
+from web.rate_limiter import RateLimitedVkApi
+from web.post_store import PostStore
 
+MANIFEST = 'manifest.json'
 
-def csv_dataset_from_db(db, post_count=1, max_posts=None):
-    app_id = int(os.environ.get('APP_ID'))
-    service_token = os.environ.get('SERVICE_TOKEN')
-    client_secret = os.environ.get('CLIENT_SECRET')
-    service_session = vk_api.VkApi(app_id=app_id, token=service_token,
-                                   client_secret=client_secret)
-    api = service_session.get_api()
 
-    session = db.create_session()
+def load_manifest(shards_dir, class_names):
+    """
+    return manifest of the previous runs: class names, IDs of the groups
+    whose posts are written and {shard file: {'rows': n, 'size': bytes}}.
+    Rows written after the last saved manifest are cut off the shards.
+    """
+    try:
+        with open(f'{shards_dir}/{MANIFEST}', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        manifest = None
+    if manifest is not None and manifest['class_names'] != class_names:
+        print('Classes have changed, the dataset is built from scratch')
+        manifest = None
+    if manifest is None:
+        manifest = {'class_names': class_names, 'groups': [], 'shards': {}}
+
+    for name in os.listdir(shards_dir):
+        if name.endswith('.csv') and name not in manifest['shards']:
+            os.remove(f'{shards_dir}/{name}')
+    for name, shard in manifest['shards'].items():
+        os.truncate(f'{shards_dir}/{name}', shard['size'])
+    return manifest
+
+
+def save_manifest(shards_dir, manifest):
+    # the old manifest stays if the run is killed while writing
+    path = f'{shards_dir}/{MANIFEST}'
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(f'{path}.tmp', path)
+
+
+def csv_dataset_from_db(db, post_count=1, max_posts=None, workers=None,
+                        fetch_workers=4, post_ttl=7 * 24 * 60 * 60,
+                        output_dir='data', shard_size=100000, queue_size=4,
+                        resume=True, vk_session=None):
+    """
+    builds {output_dir}/dataset.csv and ds_info.txt from walls of the groups
+    in the Groups table. Walls are fetched, cleaned in workers processes and
+    written by separate threads connected with queues of queue_size chunks.
+    Rows are written to shards of up to shard_size rows in
+    {output_dir}/shards, the manifest there records the groups that are
+    done, so an interrupted run continues with the rest of the groups
+    (resume=False starts from scratch). With max_posts the run stops before
+    the first group whose posts do not fit.
+    """
+    if vk_session is None:
+        vk_session = RateLimitedVkApi(
+            app_id=int(os.environ.get('APP_ID')),
+            token=os.environ.get('SERVICE_TOKEN'),
+            client_secret=os.environ.get('CLIENT_SECRET'),
+            rps=float(os.environ.get('VK_SERVICE_RPS', 3)))
+
+    with db.session() as session:
+        class_names = sorted(set([
+            cat[0].lower() for cat in
+            session.query(db.Groups.subject).distinct(db.Groups.subject)
+        ]))
+        groups = [(int(group_id), class_names.index(subject.lower()))
+                  for group_id, subject in session.query(
+                      db.Groups.group_id, db.Groups.subject).order_by(
+                      db.Groups.group_id)]
+
+    shards_dir = f'{output_dir}/shards'
+    if not resume:
+        shutil.rmtree(shards_dir, ignore_errors=True)
+    os.makedirs(shards_dir, exist_ok=True)
+    manifest = load_manifest(shards_dir, class_names)
+    done = set(manifest['groups'])
+    todo = [group for group in groups if group[0] not in done]
+    posts_loaded = sum(shard['rows'] for shard in manifest['shards'].values())
+    if done:
+        print(f'Resuming: {len(done)} groups and {posts_loaded} posts done')
+
+    workers = workers or os.cpu_count()
     cleaner = Cleaner()
+    # walls downloaded by the bot or by previous runs are reused
+    store = PostStore(db, WallFetcher(vk_session, workers=fetch_workers),
+                      ttl=post_ttl)
+    # (group IDs, [(raw text, class ID, group ID), ...]) for every chunk
+    fetched = queue.Queue(queue_size)
+    # (group IDs, [(clean text, class ID, group ID), ...])
+    cleaned = queue.Queue(queue_size)
+    stopping = threading.Event()
+    errors = []
 
-    posts_loaded = 0
-    class_names = sorted(set([
-        cat[0].lower()
-        for cat in session.query(db.Groups.subject).distinct(db.Groups.subject)
-    ]))
-
-    with open('data/dataset.csv', 'w', encoding='utf-8') as f:
-        csv_file = csv.writer(f, delimiter=',')
-        groups = session.query(db.Groups).order_by(db.Groups.group_id)
-        total = groups.count()
-        for i, group in enumerate(groups):
-            if isinstance(max_posts, int) and posts_loaded >= max_posts:
-                break
+    # the stages wait for each other in short steps, so none of them stays
+    # blocked on a full or empty queue after another one has stopped
+    def put(output, item):
+        while not stopping.is_set():
+            try:
+                output.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(source):
+        while not stopping.is_set():
             try:
-                posts = api.wall.get(owner_id=-int(group.group_id),
-                                     count=post_count)
-            except vk_api.exceptions.ApiError:
-                print(f'\rAccess denied: wall {group.group_id} id disabled')
-                continue
-            else:
-                print(f'\rPosts from group {group.group_id} received')
-                if not posts:
-                    continue
-            for post in posts['items']:
-                text = cleaner.clean_text(post['text'])
-                if not post['marked_as_ads'] and text:
-                    csv_file.writerow([
-                        text,
-                        class_names.index(group.subject.lower())
-                    ])
-                    posts_loaded += 1
-            print(f'\r[{("#"*int((i + 1) / total * 10)).ljust(10, " ")}] '
-                  f'{i + 1} of {total} ({posts_loaded} posts)', end='')
-
-    with open('data/ds_info.txt', 'w', encoding='utf-8') as f:
-        f.write(f"{','.join(class_names)}\n")
-        f.write(str(posts_loaded))
+                return source.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None
+
+    def stage(target, output):
+        def run():
+            try:
+                target()
+            except BaseException as e:
+                errors.append(e)
+                stopping.set()
+            finally:
+                put(output, None)
+        thread = threading.Thread(target=run, daemon=True,
+                                  name=f'dataset-{target.__name__}')
+        thread.start()
+        return thread
+
+    def fetch():
+        step = EXECUTE_LIMIT * fetch_workers
+        for i in range(0, len(todo), step):
+            if stopping.is_set():
+                break
+            chunk = todo[i:i + step]
+            walls, denied = store.get([group_id for group_id, _ in chunk],
+                                      post_count)
+            for group_id in denied:
+                print(f'\rAccess denied: wall {group_id} id disabled')
+            if not put(fetched, ([group_id for group_id, _ in chunk],
+                                 [(post['text'], class_id, group_id)
+                                  for group_id, class_id in chunk
+                                  for post in walls.get(group_id, [])
+                                  if not post['marked_as_ads']])):
+                break
+
+    def clean():
+        # chunks whose texts are sent to clean_batch, results come in order;
+        # at most two chunks of texts per process are read ahead, so the
+        # queues bound the posts kept in memory
+        pending = deque()
+
+        def texts():
+            while True:
+                chunk = get(fetched)
+                if chunk is None:
+                    return
+                pending.append((chunk[0], [row[1:] for row in chunk[1]], []))
+                for text, _, _ in chunk[1]:
+                    yield text
+
+        def send_ready():
+            while pending and len(pending[0][2]) == len(pending[0][1]):
+                group_ids, labels, texts_done = pending.popleft()
+                if not put(cleaned, (group_ids, [
+                        (text, *label)
+                        for text, label in zip(texts_done, labels) if text])):
+                    return False
+            return True
+
+        results = cleaner.clean_batch(texts(), workers=workers,
+                                      min_parallel=0,
+                                      max_pending=2 * workers)
+        try:
+            for text in results:
+                if not send_ready():
+                    return
+                pending[0][2].append(text)
+            send_ready()
+        finally:
+            # stops the pool of clean_batch
+            results.close()
+
+    threads = [stage(fetch, fetched), stage(clean, cleaned)]
+
+    shard_name = f'part-{len(manifest["shards"]):05d}.csv'
+    shard_file = None
+    try:
+        while True:
+            chunk = get(cleaned)
+            if chunk is None:
+                break
+            group_ids, rows = chunk
+            limit = (max(max_posts - posts_loaded, 0)
+                     if isinstance(max_posts, int) else None)
+            full = limit is not None and len(rows) >= limit
+            if full and len(rows) > limit:
+                # only the groups before the first one whose posts do not
+                # fit are written, the next run fetches the rest again
+                cut = rows[limit][2]
+                group_ids = group_ids[:group_ids.index(cut)]
+                rows = rows[:[row[2] for row in rows].index(cut)]
+            while rows:
+                if shard_file is None or \
+                        manifest['shards'][shard_name]['rows'] >= shard_size:
+                    if shard_file is not None:
+                        shard_file.close()
+                        shard_name = f'part-{len(manifest["shards"]):05d}.csv'
+                    shard_file = open(f'{shards_dir}/{shard_name}', 'w',
+                                      encoding='utf-8')
+                    manifest['shards'][shard_name] = {'rows': 0, 'size': 0}
+                shard = manifest['shards'][shard_name]
+                part = rows[:shard_size - shard['rows']]
+                rows = rows[len(part):]
+                csv.writer(shard_file, delimiter=',').writerows(
+                    (text, class_id) for text, class_id, _ in part)
+                shard_file.flush()
+                shard['rows'] += len(part)
+                shard['size'] = shard_file.tell()
+                posts_loaded += len(part)
+            manifest['groups'].extend(group_ids)
+            save_manifest(shards_dir, manifest)
+
+            groups_done = len(manifest['groups'])
+            bar = '#' * int(groups_done / len(groups) * 10)
+            print(f'\r[{bar.ljust(10, " ")}] '
+                  f'{groups_done} of {len(groups)} ({posts_loaded} posts)',
+                  end='')
+            if full:
+                stopping.set()
+    finally:
+        stopping.set()
+        if shard_file is not None:
+            shard_file.close()
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+
+    print(f'\nMerging {len(manifest["shards"])} shards ...')
+    with open(f'{output_dir}/dataset.csv', 'wb') as f:
+        for name in sorted(manifest['shards']):
+            with open(f'{shards_dir}/{name}', 'rb') as shard_file:
+                shutil.copyfileobj(shard_file, f)
+
+    print(f'Lemmatization cache: {cleaner.stats()}')
+    print(f'Post store: {store.stats()}')
+
+    with open(f'{output_dir}/ds_info.txt', 'w', encoding='utf-8') as f:
+        f.write(f"{','.join(manifest['class_names'])}\n")
+        f.write(str(sum(shard['rows']
+                        for shard in manifest['shards'].values())))
@@ -0,0 +1,39 @@
+import numpy as np
+
+from model.numpy_model import NumpyModel
+from model.predictor import Predictor, INFERENCE_FILE, read_params
+
+
+def export_model(model_name, check_texts=None, atol=1e-5):
+    """
+    converts models/{model_name}/checkpoint to plain numpy arrays
+    (models/{model_name}/inference.npz) used by Predictor without tensorflow
+    and checks that both backends give the same predictions
+    """
+    keras_predictor = Predictor(model_name, backend='keras')
+    vectorize_layer, classifier = keras_predictor.model.layers
+    embedding = classifier.layers[0].get_weights()[0]
+    kernel, bias = classifier.layers[-1].get_weights()
+    _, sequence_length, _ = read_params(model_name)
+
+    model = NumpyModel(vocabulary=vectorize_layer.get_vocabulary(),
+                       embedding=embedding,
+                       kernel=kernel,
+                       bias=bias,
+                       sequence_length=sequence_length)
+    path = f'models/{model_name}/{INFERENCE_FILE}'
+    model.save(path)
+    print(f'{model_name}: {len(model.vocabulary)} words, '
+          f'embedding {embedding.shape}, dense {kernel.shape} -> {path}')
+
+    if check_texts is None:
+        check_texts = model.vocabulary[2:1000] + [
+            ' '.join(model.vocabulary[i:i + sequence_length * 2])
+            for i in range(2, len(model.vocabulary), sequence_length)]
+    keras_result = keras_predictor.model.predict(check_texts)
+    numpy_result = NumpyModel.load(path).predict(check_texts)
+    max_diff = float(np.abs(keras_result - numpy_result).max())
+    print(f'max difference on {len(check_texts)} texts: {max_diff}')
+    if max_diff > atol:
+        raise ValueError(f'Exported model differs from {model_name} '
+                         f'checkpoint by {max_diff}')
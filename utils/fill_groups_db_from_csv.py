@@ -1,31 +1,94 @@
 import os
 import csv
-import vk_api
+from sqlalchemy.exc import OperationalError
 
+from web.rate_limiter import RateLimitedVkApi
+
+# groups.getById takes at most 500 ids
+GET_BY_ID_LIMIT = 500
+
+
+def read_checkpoint(path):
+    """return number of the csv rows imported by an interrupted run"""
+    try:
+        with open(path, encoding='utf-8') as file:
+            return int(file.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def write_checkpoint(path, rows_done):
+    # the old checkpoint stays if the run is killed while writing
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as file:
+        file.write(str(rows_done))
+    os.replace(f'{path}.tmp', path)
+
+
+def fill_groups_db_from_csv(db, csv_path: str = 'data/obrazovanie_2.csv',
+                            batch_size=GET_BY_ID_LIMIT, checkpoint_path=None,
+                            vk_session=None):
+    """
+    adds the groups of the csv file (id;link;subject) missing in the
+    GroupsIds table. Names and links of batch_size groups are read with one
+    groups.getById call and inserted in one transaction, then the number of
+    imported rows is saved to checkpoint_path ({csv_path}.checkpoint by
+    default), so an interrupted run continues after the last batch
+    """
+    if vk_session is None:
+        vk_session = RateLimitedVkApi(
+            app_id=int(os.environ.get('APP_ID')),
+            token=os.environ.get('SERVICE_TOKEN'),
+            client_secret=os.environ.get('CLIENT_SECRET'),
+            rps=float(os.environ.get('VK_SERVICE_RPS', 3)))
+    api = vk_session.get_api()
+    batch_size = min(batch_size, GET_BY_ID_LIMIT)
+    checkpoint_path = checkpoint_path or f'{csv_path}.checkpoint'
 
-def fill_groups_db_from_csv(db, csv_path: str = 'data/obrazovanie_2.csv'):
-    app_id = int(os.environ.get('APP_ID'))
-    service_token = os.environ.get('SERVICE_TOKEN')
-    client_secret = os.environ.get('CLIENT_SECRET')
-    service_session = vk_api.VkApi(app_id=app_id, token=service_token,
-                                   client_secret=client_secret)
-    api = service_session.get_api()
-    session = db.create_session()
     with open(csv_path, encoding='utf-8-sig') as file:
-        csv_file = csv.reader(file, delimiter=';', )
-        for i, row in enumerate(csv_file):
-            group = session.query(db.GroupsIds).filter(
-                db.GroupsIds.group_id == int(row[0])).first()
-            if group:
-                continue
-            info = api.groups.getById(group_id=int(row[0]))[0]
-            session.add(db.GroupsIds(group_id=int(row[0]),
-                                     name=info['name'],
-                                     subject=row[2].lower(),
-                                     link=info['screen_name']))
-            print(f'adding: id = {row[0]}, name = {info["name"]}, subject = '
-                  f'{row[2]}, link = {info["screen_name"]}')
-            if i % 100 == 0:
+        rows = [(abs(int(row[0])), row[2].lower())
+                for row in csv.reader(file, delimiter=';') if row]
+    start = read_checkpoint(checkpoint_path)
+    if start:
+        print(f'Resuming from row {start} of {len(rows)}')
+
+    table = db.GroupsIds
+    try:
+        table.__table__.create(db.engine, checkfirst=True)
+    except OperationalError:
+        # the index name is taken by the Groups table of older databases,
+        # the table is created without it
+        pass
+    with db.session() as session:
+        existing = {group_id for group_id, in session.query(table.group_id)}
+
+    added = 0
+    for i in range(start, len(rows), batch_size):
+        subjects = {}
+        for group_id, subject in rows[i:i + batch_size]:
+            if group_id not in existing:
+                subjects.setdefault(group_id, subject)
+        if subjects:
+            infos = api.groups.getById(
+                group_ids=','.join(map(str, subjects)))
+            found = {info['id']: info for info in infos}
+            mappings = [{'group_id': group_id,
+                         'name': found[group_id]['name'],
+                         'subject': subject,
+                         'link': found[group_id]['screen_name']}
+                        for group_id, subject in subjects.items()
+                        if group_id in found]
+            for group_id in subjects.keys() - found.keys():
+                print(f'\rGroup {group_id} is not found')
+            with db.session() as session:
+                session.bulk_insert_mappings(table, mappings)
                 session.commit()
-                print(f'{i}: commit completed')
-    session.commit()
+            existing.update(subjects)
+            added += len(mappings)
+        done = min(i + batch_size, len(rows))
+        write_checkpoint(checkpoint_path, done)
+        print(f'\r{done} of {len(rows)} rows, {added} groups added', end='')
+
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    print(f'\nImport completed: {added} groups added')
+    return added
@@ -10,7 +10,7 @@ def get_referat(category):
     return ' '.join(i.text for i in text)
 
 
-def yandex_referats_to_ds(count=10):
+def yandex_referats_to_ds(count=10, workers=None):
     categories = [
         'astronomy',
         'geology',
@@ -35,13 +35,16 @@ def yandex_referats_to_ds(count=10):
     with open('data/ds2/ds_info.txt', 'w', encoding='utf-8') as f:
         f.write(f"{','.join(categories)}\n{len(categories) * count}")
 
+    referats = []
+    for i, cat in enumerate(categories):
+        for j in range(count):
+            print(f'\r{cat.ljust(20, " ")}'
+                  f'({i + 1}/{len(categories)})\t'
+                  f'({j + 1}/{count})', end='')
+            referats.append((get_referat(cat), i))
+        print()
+
+    texts = c.clean_batch((text for text, _ in referats), workers=workers)
     with open('data/ds2/dataset.csv', 'w', encoding='utf-8') as f:
-        for i, cat in enumerate(categories):
-            text = ''
-            for j in range(count):
-                print(f'\r{cat.ljust(20, " ")}'
-                      f'({i + 1}/{len(categories)})\t'
-                      f'({j + 1}/{count})', end='')
-                text += f'{c.clean_text(get_referat(cat))},{i}\n'
-            print()
-            f.write(text)
+        for text, (_, i) in zip(texts, referats):
+            f.write(f'{text},{i}\n')
@@ -1,11 +1,12 @@
 import os
 import json
+import atexit
 import threading
 
 from random import sample
 from typing import List, Union, Dict
 from operator import itemgetter
-from sqlalchemy import or_
+from concurrent.futures import ThreadPoolExecutor
 
 import vk_api
 from vk_api.bot_longpoll import VkBotLongPoll, VkBotEventType
@@ -13,18 +14,69 @@ from vk_api.keyboard import VkKeyboard, VkKeyboardColor
 from vk_api.utils import get_random_id
 
 from model.predictor import Predictor
+from model.batcher import BatchPredictor
+from model.prediction_cache import PredictionCache
+from model.registry import ModelRegistry
+from model.progressive import ProgressiveRanking
+from model.labels import KnownGroups
+from model.snapshots import SubscriptionSnapshots
+from web.wall_fetcher import WallFetcher, posts_text
+from web.rate_limiter import RateLimitedVkApi
+from web.single_flight import SingleFlight
+from web.post_store import PostStore
+from web.catalog import GroupsCatalog, RecommendationCatalog
+from web.user_states import UserStates
+from web.dispatcher import Dispatcher
+from web.job_queue import JobQueue, RUNNING
+
+# number of groups without a subject predicted for one analysis
+ANALYSIS_SAMPLE = 100
 
 
 class Bot:
-    def __init__(self, users_db, groups_db, model_name):
-        group_token = os.environ['GROUP_TOKEN']
-        group_id = int(os.environ['GROUP_ID'])
-        service_token = os.environ['SERVICE_TOKEN']
-        app_id = int(os.environ['APP_ID'])
-        client_secret = os.environ['CLIENT_SECRET']
+    def __init__(self, users_db, groups_db, model_name, models_dir='models',
+                 group_vk_session=None, service_vk_session=None,
+                 worker=False):
+        """
+        :param users_db: users database
+        :param groups_db: groups database
+        :param model_name: name of the model used by default
+        :param models_dir: directory with models
+        :param group_vk_session: VkApi with the group token,
+        made from GROUP_TOKEN by default
+        :param service_vk_session: VkApi with the service token,
+        made from APP_ID, SERVICE_TOKEN and CLIENT_SECRET by default
+        :param worker: the bot only runs analyses taken by worker.py from
+        the job queue, so it has no dispatcher and no job queue of its own
+        """
+        self.group_id = int(os.environ['GROUP_ID'])
+        # requests per second allowed for every token, split between the
+        # listener and the worker processes with SHARDS (see web.sharding)
+        shards = int(os.environ.get('SHARDS', 0))
+        if group_vk_session is None:
+            group_vk_session = RateLimitedVkApi(
+                token=os.environ['GROUP_TOKEN'], api_version='5.126',
+                rps=float(os.environ.get('VK_GROUP_RPS', 20)) / (shards + 1))
+        if service_vk_session is None:
+            service_vk_session = RateLimitedVkApi(
+                app_id=int(os.environ['APP_ID']),
+                token=os.environ['SERVICE_TOKEN'],
+                client_secret=os.environ['CLIENT_SECRET'],
+                rps=float(os.environ.get('VK_SERVICE_RPS', 3)) /
+                max(shards, 1))
 
         self.visited = set()
         self.processing = set()
+        self.processing_lock = threading.Lock()
+
+        # 'pool' handles messages in DISPATCH_WORKERS threads, messages of
+        # one user one after another; 'thread' starts a thread per message
+        self.dispatch_mode = os.environ.get('DISPATCH_MODE', 'pool')
+        self.dispatcher = None
+        if self.dispatch_mode == 'pool' and not worker:
+            self.dispatcher = Dispatcher(
+                workers=int(os.environ.get('DISPATCH_WORKERS', 8)),
+                max_queue=int(os.environ.get('DISPATCH_QUEUE', 100)))
 
         self.admin_pwd = os.environ['ADMIN_PWD']
         self.new_cats = sorted(['физика', 'математика', 'лингвистика',
@@ -33,27 +85,86 @@ class Bot:
                                 "история", "музыка", "астрономия", "маркетинг",
                                 "биология", "спорт", "искусство", "бизнес"])
 
-        self.predictor = Predictor(model_name)
+        batch_size = int(os.environ.get('PREDICT_BATCH_SIZE', 512))
+        batch_wait = float(os.environ.get('PREDICT_BATCH_WAIT', 0.05))
+        self.models = ModelRegistry(
+            model_name,
+            factory=lambda name: BatchPredictor(
+                Predictor(name, models_dir=models_dir),
+                max_batch_size=batch_size,
+                max_wait=batch_wait),
+            models_dir=models_dir,
+            idle_timeout=int(os.environ.get('MODEL_IDLE_TIMEOUT', 600)))
+        self.models.get()
+        self.prediction_cache = PredictionCache(
+            groups_db,
+            ttl=int(os.environ.get('PREDICTION_TTL', 24 * 60 * 60)),
+            max_size=int(os.environ.get('PREDICTION_CACHE_SIZE', 100000)))
+        # all the groups are predicted at once; with ANALYSIS_PROGRESSIVE=1
+        # they are predicted by chunks and the analysis stops when the top
+        # classes are stable, which is slower unless it stops early
+        self.progressive = os.environ.get('ANALYSIS_PROGRESSIVE', '0') == '1'
+        self.analysis_chunk = int(os.environ.get('ANALYSIS_CHUNK', 25))
+        self.stable_chunks = int(os.environ.get('ANALYSIS_STABLE_CHUNKS', 2))
+        self.stable_margin = float(os.environ.get('ANALYSIS_MARGIN', 0.05))
+        self.prefetcher = ThreadPoolExecutor(
+            int(os.environ.get('VK_FETCH_WORKERS', 4)),
+            thread_name_prefix='prefetch')
+        # groups are kept in memory and loaded again every
+        # GROUPS_CATALOG_RELOAD seconds, GROUPS_CATALOG=db reads them from
+        # the groups database every time
+        if os.environ.get('GROUPS_CATALOG', 'memory') == 'memory':
+            self.catalog = GroupsCatalog(
+                groups_db, page_size=10,
+                reload=int(os.environ.get('GROUPS_CATALOG_RELOAD', 10 * 60)))
+        else:
+            self.catalog = RecommendationCatalog(
+                groups_db, page_size=10,
+                ttl=int(os.environ.get('CATALOG_COUNT_TTL', 60 * 60)))
+        self.known_groups = KnownGroups(
+            self.catalog,
+            smoothing=float(os.environ.get('KNOWN_GROUP_SMOOTHING', 0.1)))
+        self.snapshots = SubscriptionSnapshots(
+            users_db,
+            ttl=int(os.environ.get('SNAPSHOT_TTL', 7 * 24 * 60 * 60)),
+            max_change=float(os.environ.get('SNAPSHOT_MAX_CHANGE', 0.5)))
         self.users_db = users_db
+        # user statuses are read from memory and written in batches
+        self.user_states = UserStates(
+            users_db,
+            flush_interval=float(os.environ.get('USER_FLUSH_INTERVAL', 1)),
+            max_dirty=int(os.environ.get('USER_FLUSH_SIZE', 100)),
+            # worker processes of ANALYSIS_MODE=jobs change users too
+            ttl=0 if os.environ.get('ANALYSIS_MODE') == 'jobs' else
+            int(os.environ.get('USER_CACHE_TTL', 10 * 60)))
+        atexit.register(self.user_states.close)
         self.groups_db = groups_db
-        self.groups_session = vk_api.VkApi(token=group_token,
-                                          api_version='5.126')
-        self.service_session = vk_api.VkApi(app_id=app_id,
-                                            token=service_token,
-                                            client_secret=client_secret)
-        self.long_poll = VkBotLongPoll(self.groups_session, group_id)
+        # with ANALYSIS_MODE=jobs analyses are run by worker.py processes
+        self.worker = worker
+        self.jobs = None
+        if os.environ.get('ANALYSIS_MODE') == 'jobs' and not worker:
+            self.jobs = JobQueue(
+                users_db,
+                max_attempts=int(os.environ.get('JOB_MAX_ATTEMPTS', 3)),
+                lease=int(os.environ.get('JOB_LEASE', 10 * 60)))
+        self.groups_session = group_vk_session
+        self.service_session = service_vk_session
+        # connects to VK, so it is made when the bot starts listening
+        self.long_poll = None
         self.group_api = self.groups_session.get_api()
         self.service_api = self.service_session.get_api()
+        # identical VK requests of concurrent users are sent once
+        self.single_flight = SingleFlight()
+        self.wall_fetcher = WallFetcher(
+            self.service_session,
+            workers=int(os.environ.get('VK_FETCH_WORKERS', 4)),
+            single_flight=self.single_flight)
+        self.post_store = PostStore(
+            groups_db, self.wall_fetcher,
+            ttl=int(os.environ.get('POST_TTL', 6 * 60 * 60)))
 
         # For dataset filtering
-        groups_session = groups_db.create_session()
-        self.latest_id = groups_session.query(
-            groups_db.Groups.group_id).order_by(
-            groups_db.Groups.group_id.desc()).first()
-        if self.latest_id is None:
-            self.latest_id = 0
-        else:
-            self.latest_id = self.latest_id[0]
+        self.latest_id = self.catalog.latest_id()
 
     def send_message(self,
                      user_id: int,
@@ -76,14 +187,200 @@ class Bot:
               f' to {user_id} has been sent')
 
     def get_posts(self, owner_id, texts, count=1):
-        posts = self.service_api.wall.get(owner_id=owner_id, count=count)
-        try:
-            posts = map(itemgetter('text'),
-                        filter(lambda x: not x['marked_as_ads'],
-                               posts['items']))
-            texts.append('\n'.join(posts))
-        except IndexError:
-            print(f'error: {owner_id} {posts}')
+        texts.append(posts_text(self.get_wall(owner_id, count)))
+
+    def get_wall(self, owner_id: int, count=1) -> List[Dict]:
+        """
+        gets posts from the post store, outdated walls are downloaded
+        using method wall.get (https://vk.com/dev/wall.get)
+
+        :param owner_id: wall owner ID (negative for groups)
+        :param count: number of posts
+        :return: list of posts
+        """
+        walls, errors = self.post_store.get([abs(owner_id)], count)
+        if abs(owner_id) in errors:
+            raise vk_api.exceptions.ApiError(
+                self.service_session, 'wall.get',
+                {'owner_id': owner_id, 'count': count}, False,
+                errors[abs(owner_id)])
+        return walls[abs(owner_id)]
+
+    def predict_groups(self, group_ids: List[int], from_id: int,
+                       predictor) -> Dict[int, List[float]]:
+        """
+        gets model output for every group, only the groups that are missing
+        in the prediction cache or whose newest post has changed since
+        are predicted
+
+        :param group_ids: group IDs
+        :param from_id: ID of the user the analysis is made for
+        :param predictor: predictor of the model to use
+        :return: {group_id: row of class scores} of the available groups
+        """
+        cached = self.prediction_cache.get(predictor.model_name, group_ids)
+        scores = {_id: prediction.scores for _id, prediction in cached.items()
+                  if prediction.fresh}
+
+        walls, errors = self.post_store.get(
+            [_id for _id in group_ids
+             if _id not in cached or not cached[_id].fresh], 10)
+        print(f'{len(walls)} walls received, {len(errors)} are not '
+              f'available (user {from_id})')
+
+        texts = []
+        new_groups = []
+        revalidated = {}
+        for _id, posts in walls.items():
+            post_id = max((post['id'] for post in posts), default=0)
+            if _id in cached and cached[_id].post_id == post_id:
+                scores[_id] = cached[_id].scores
+                revalidated[_id] = (post_id, cached[_id].scores)
+            else:
+                texts.append(posts_text(posts))
+                new_groups.append((_id, post_id))
+
+        print(f'Predicting {len(texts)} of {len(group_ids)} groups...')
+        rows = predictor.predict_texts(texts) if texts else []
+
+        predicted = {_id: (post_id, row)
+                     for (_id, post_id), row in zip(new_groups, rows)}
+        scores.update({_id: row for _id, (_, row) in predicted.items()})
+        self.prediction_cache.put(predictor.model_name,
+                                  {**revalidated, **predicted})
+        self.prediction_cache.count(
+            fresh=len(scores) - len(rows) - len(revalidated),
+            revalidated=len(revalidated),
+            predicted=len(texts))
+        return scores
+
+    def predict_progressively(self, group_ids: List[int], from_id: int,
+                              predictor, known_scores=None):
+        """
+        predicts groups by chunks of analysis_chunk, sends the preliminary
+        top-3 after the first chunk and stops when the top-3 is stable
+
+        :param group_ids: group IDs
+        :param from_id: ID of the user the analysis is made for
+        :param predictor: predictor of the model to use
+        :param known_scores: {group_id: row of class scores} of the groups
+        that are not predicted
+        :return: names of the top-3 classes and {group_id: row of class
+        scores} of the scored groups
+        """
+        ranking = ProgressiveRanking(predictor.class_names,
+                                     stable_chunks=self.stable_chunks,
+                                     margin=self.stable_margin)
+        scores = dict(known_scores or {})
+        if scores:
+            ranking.update(list(scores.values()))
+        chunks = [group_ids[i:i + self.analysis_chunk]
+                  for i in range(0, len(group_ids), self.analysis_chunk)]
+        for n, chunk in enumerate(chunks):
+            # walls of the next chunk are downloaded during the prediction,
+            # unless the analysis may stop after this chunk: then they are
+            # not requested before it goes on, so no execute call is wasted
+            prefetch = n + 1 < len(chunks)
+            if prefetch and not ranking.may_stop:
+                self.prefetcher.submit(self.prefetch_walls, chunks[n + 1],
+                                       predictor)
+                prefetch = False
+            chunk_scores = self.predict_groups(chunk, from_id, predictor)
+            scores.update(chunk_scores)
+            prediction = ranking.update(list(chunk_scores.values()))
+            if ranking.stable:
+                break
+            if prefetch:
+                self.prefetcher.submit(self.prefetch_walls, chunks[n + 1],
+                                       predictor)
+            if n == 0 and len(chunks) > 1:
+                self.send_message(
+                    from_id, 'Предварительный результат:\n' + '\n'.join(
+                        f'{i}. {category.capitalize()}'
+                        for i, category in enumerate(prediction, 1)))
+        print(f'Analysis of {from_id}: {ranking.rows} groups in '
+              f'{ranking.chunks} chunks'
+              f'{", stopped early" if ranking.stable else ""}')
+        return ranking.result(), scores
+
+    def analyse(self, group_ids: List[int], from_id: int, predictor):
+        """
+        scores the groups with a subject by their label and up to
+        ANALYSIS_SAMPLE other groups by the model
+
+        :param group_ids: IDs of all the subscriptions
+        :param from_id: ID of the user the analysis is made for
+        :param predictor: predictor of the model to use
+        :return: names of the top-3 classes and {group_id: row of class
+        scores} of the scored groups
+        """
+        known = self.known_groups.scores(group_ids, predictor.class_names)
+        # only the groups without a subject are sampled and predicted
+        unknown = [_id for _id in group_ids if _id not in known]
+        if len(unknown) > ANALYSIS_SAMPLE:
+            unknown = sample(unknown, ANALYSIS_SAMPLE)
+        if self.progressive:
+            return self.predict_progressively(unknown, from_id, predictor,
+                                              known)
+        scores = {**known, **self.predict_groups(unknown, from_id,
+                                                 predictor)}
+        prediction = list(map(itemgetter(0),
+                              predictor.rank(list(scores.values()))[:3]))
+        return prediction, scores
+
+    def reanalyse(self, snapshot, group_ids: List[int], from_id: int,
+                  predictor):
+        """
+        updates the scores of the last analysis with the groups the user
+        has subscribed to or unsubscribed from since then
+
+        :param snapshot: model.snapshots.Snapshot of the last analysis
+        :param group_ids: IDs of all the subscriptions
+        :param from_id: ID of the user the analysis is made for
+        :param predictor: predictor of the model to use
+        :return: names of the top-3 classes and {group_id: row of class
+        scores} of the scored groups, or None if the analysis has to be
+        made from scratch
+        """
+        added = set(group_ids) - snapshot.subscriptions
+        removed = set(snapshot.scores) - set(group_ids)
+        if self.snapshots.changed_too_much(snapshot, added, removed):
+            return None
+
+        # the scores of the removed groups are the ones of the snapshot,
+        # even if the groups have been predicted again since then
+        scores = {_id: row for _id, row in snapshot.scores.items()
+                  if _id not in removed}
+        known = self.known_groups.scores(list(added | set(scores)),
+                                         predictor.class_names)
+        unknown = [_id for _id in added if _id not in known]
+        if (len(unknown) +
+                len([_id for _id in scores if _id not in known]) >
+                ANALYSIS_SAMPLE):
+            # the predicted groups would outweigh the sample of a full
+            # analysis
+            return None
+
+        scores.update({_id: known[_id] for _id in added if _id in known})
+        scores.update(self.predict_groups(unknown, from_id, predictor))
+        if not scores:
+            return None
+
+        print(f'Re-analysis of {from_id}: {len(added)} groups added, '
+              f'{len(removed)} removed')
+        prediction = list(map(itemgetter(0),
+                              predictor.rank(list(scores.values()))[:3]))
+        return prediction, scores
+
+    def prefetch_walls(self, group_ids: List[int], predictor) -> None:
+        """
+        puts walls of the groups that predict_groups will need to the post
+        store
+        """
+        cached = self.prediction_cache.get(predictor.model_name, group_ids)
+        self.post_store.get([_id for _id in group_ids
+                             if _id not in cached or not cached[_id].fresh],
+                            10)
 
     def get_subscriptions(self, user_id: int, count=100) -> List[int]:
         """
@@ -91,7 +388,7 @@ class Bot:
         (https://vk.com/dev/users.getSubscriptions)
 
         :param user_id: user ID
-        :param count: get random {count} groups
+        :param count: get random {count} groups, all of them if None
         :return: list of numbers defining user IDs
         """
         subscriptions = self.service_api.users.getSubscriptions(
@@ -104,7 +401,8 @@ class Bot:
                if not i['is_closed'] and
                'type' in i and
                'deactivated' not in i]
-        return ids if len(ids) <= count else sample(ids, count)
+        return ids if count is None or len(ids) <= count else \
+            sample(ids, count)
 
     def get_group_info(self, group_id: int) -> Union[
         Dict[str, Union[str, int]], List[Dict[str, Union[str, int]]]
@@ -117,7 +415,9 @@ class Bot:
         :return: list of dictionaries of dictionary, describing information
         about group
         """
-        info = self.service_api.groups.getById(group_id=group_id)
+        info = self.single_flight.do(('groups.getById', group_id),
+                                     self.service_api.groups.getById,
+                                     group_id=group_id)
         print(f'received info from {group_id}')
         if len(info) == 1:
             return info[0]
@@ -129,11 +429,35 @@ class Bot:
         gets updates from server and handling them
         :return: None
         """
+        if self.long_poll is None:
+            self.long_poll = VkBotLongPoll(self.groups_session, self.group_id)
         for event in self.long_poll.listen():
-            if event.type == VkBotEventType.MESSAGE_NEW:
+            if event.type != VkBotEventType.MESSAGE_NEW:
+                continue
+            if self.dispatcher is None:
                 threading.Thread(
                     target=self.process_new_message, args=(event,)
                 ).start()
+            else:
+                self.dispatch(event)
+
+    def dispatch(self, event) -> None:
+        """
+        queues the message to the dispatcher, tells the user about the
+        position in the queue or that the bot is overloaded
+        :return: None
+        """
+        from_id = event.object['message']['from_id']
+        # the answer that the analysis is running does not wait for it
+        key = None if from_id in self.processing else from_id
+        position = self.dispatcher.submit(key, self.process_new_message,
+                                          event)
+        if position is None:
+            self.send_message(from_id, 'Сейчас слишком много запросов, '
+                                       'попробуйте позже')
+        elif position > 0:
+            self.send_message(from_id, f'Вы в очереди: {position}. '
+                                       f'Ответ придёт автоматически')
 
     def process_new_message(self, event):
         from_id = event.object['message']['from_id']
@@ -147,12 +471,20 @@ class Bot:
         payload = json.loads(event.object['message'].get('payload', '{}'))
 
         if payload.get('button') == 'start_analysis':
-            self.command_start_analysis(from_id)
+            if self.jobs is None:
+                self.command_start_analysis(from_id)
+            else:
+                self.command_queue_analysis(from_id)
         elif ('button' in payload and
               'show_recommendation' in payload['button']):
             self.command_show_recommendation(from_id, payload)
         elif ''.join(filter(str.isalpha, cmd.lower())) == self.admin_pwd:
             self.command_admin(from_id)
+        elif payload.get('button') == 'admin_stats':
+            self.command_admin_stats(from_id)
+        elif ('button' in payload and
+              payload['button'].startswith('admin_models')):
+            self.command_admin_models(from_id, payload)
         elif ('button' in payload and
               'dataset_filter' in payload['button']):
             self.command_dataset_filter(from_id, payload)
@@ -160,7 +492,6 @@ class Bot:
             self.command_start(from_id)
 
     def command_start(self, from_id):
-        users_session = self.users_db.create_session()
         keyboard = VkKeyboard(one_time=True)
         keyboard.add_button('Начать анализ',
                             color=VkKeyboardColor.POSITIVE,
@@ -169,7 +500,7 @@ class Bot:
                'определить ваши интересы и подскажу, где найти ещё больше '
                'полезных групп ВКонтакте. Начнём анализ?')
 
-        user = self.get_user(from_id, users_session)
+        user = self.get_user(from_id)
         if user and user.subjects:
             keyboard.add_button('Перейти к рекомендациям',
                                 color=VkKeyboardColor.SECONDARY,
@@ -180,29 +511,18 @@ class Bot:
                    if from_id in self.visited else 'Нужно нажать на кнопку')
             self.visited.add(from_id)
         self.send_message(from_id, msg, keyboard.get_keyboard())
-        user_status = self.get_user(from_id, users_session)
-        if user_status:
-            user_status.status = 'started'
-        else:
-            users_session.add(
-                self.users_db.UserStatuses(user_id=from_id, status='started'))
+        if not user:
             print(f'=== user {from_id} added')
-        users_session.commit()
+        self.user_states.set(from_id, status='started')
 
     def command_start_analysis(self, from_id):
-        users_session = self.users_db.create_session()
-        groups_session = self.groups_db.create_session()
-        texts = []
-
-        user_status = self.get_user(from_id, users_session)
+        user_status = self.get_user(from_id)
         if not user_status:
-            users_session.add(
-                self.users_db.UserStatuses(user_id=from_id, status='started'))
+            self.user_states.set(from_id, status='started')
             print(f'=== user {from_id} added (stranger analysis)')
-        users_session.commit()
 
         try:
-            group_ids = self.get_subscriptions(from_id)
+            group_ids = self.get_subscriptions(from_id, count=None)
         except vk_api.exceptions.ApiError:
             message = 'Ваш профиль закрыт, я не могу увидеть подписки'
             keyboard = VkKeyboard(one_time=True)
@@ -213,28 +533,42 @@ class Bot:
             self.send_message(from_id, message, keyboard.get_keyboard())
             return
 
+        with self.processing_lock:
+            busy = from_id in self.processing
+            self.processing.add(from_id)
+        if busy:
+            self.send_message(from_id, 'Подождите, анализ выполняется')
+            return
+
         message = ('Анализ может занять несколько минут. Пожалуйста, '
                    'подождите.')
         self.send_message(from_id, message)
-        self.processing.add(from_id)
-
-        for _id in group_ids[:100]:
-            try:
-                self.get_posts(-_id, texts, 10)
-                print(f'group {_id} posts received (user {from_id})')
-            except TypeError:
-                continue
 
-        print("Predicting...")
-
-        prediction = list(map(itemgetter(0),
-                              self.predictor.predict(texts)[:3]))
-
-        user_status = self.get_user(from_id, users_session)
-        user_status.subjects = '&'.join(prediction)
-        user_status.status = 'show_page'
-        user_status.page = 1
-        users_session.commit()
+        try:
+            with self.models.use() as predictor:
+                # a repeated analysis scores only the changed subscriptions
+                snapshot = self.snapshots.get(from_id, predictor.model_name)
+                update = None
+                if snapshot is not None:
+                    update = self.reanalyse(snapshot, group_ids, from_id,
+                                            predictor)
+                if update is None:
+                    update = self.analyse(group_ids, from_id, predictor)
+                    self.snapshots.count(full=1)
+                else:
+                    self.snapshots.count(incremental=1)
+                prediction, scores = update
+                self.snapshots.put(from_id, predictor.model_name, group_ids,
+                                   scores)
+        except Exception:
+            self.processing.discard(from_id)
+            raise
+
+        self.user_states.set(from_id, subjects='&'.join(prediction),
+                             status='show_page', page=1)
+        if self.worker:
+            # the bot process reads the result of this worker process
+            self.user_states.flush()
 
         message = ('В ходе анализа было выявлено, что вас '
                    'интересуют следующие категории групп:\n')
@@ -249,21 +583,17 @@ class Bot:
                             payload=json.dumps(
                                 {'button': 'start_analysis'}))
 
-        group_ids = groups_session.query(self.groups_db.Groups).filter(
-            or_(self.groups_db.Groups.subject == prediction[0],
-                self.groups_db.Groups.subject == prediction[1],
-                self.groups_db.Groups.subject == prediction[2])
-        ).all()
+        groups_count = self.catalog.size(prediction)
 
-        if len(group_ids) > 0:
-            show_groups = group_ids[:10]
+        if groups_count > 0:
+            show_groups = self.catalog.page(prediction, 1)
             message = 'Страница 1:\n'
             message += '\n'.join([
                 f'{i + 1}. {show_groups[i].name} -- '
                 f'https://vk.com/club{show_groups[i].group_id} '
                 for i in range(len(show_groups))
             ])
-            page_number = len(group_ids) // 10 + 1
+            page_number = groups_count // 10 + 1
 
             keyboard.add_line()
             keyboard.add_button(f'Страница {page_number}',
@@ -284,18 +614,22 @@ class Bot:
 
         self.processing.discard(from_id)
 
-    def command_show_recommendation(self, from_id, payload):
-        users_session = self.users_db.create_session()
-        groups_session = self.groups_db.create_session()
+    def command_queue_analysis(self, from_id):
+        job, created = self.jobs.enqueue(from_id)
+        if not created and job.state == RUNNING:
+            self.send_message(from_id, 'Подождите, анализ выполняется')
+            return
+        print(f'=== analysis of {from_id} queued (job {job.id})')
+        self.send_message(from_id, f'Анализ поставлен в очередь: '
+                                   f'{self.jobs.position(job)}. Ответ придёт '
+                                   f'автоматически')
 
+    def command_show_recommendation(self, from_id, payload):
         page = int(payload['button'].split('_')[2])
-        recommendation = self.get_user(from_id, users_session)
+        recommendation = self.get_user(from_id)
         recommendation = recommendation.subjects.split('&')
-        group_ids = groups_session.query(self.groups_db.Groups).filter(or_(
-            self.groups_db.Groups.subject == recommendation[0],
-            self.groups_db.Groups.subject == recommendation[1],
-            self.groups_db.Groups.subject == recommendation[2])).all()
-        show_groups = group_ids[(page - 1) * 10:page * 10]
+        groups_count = self.catalog.size(recommendation)
+        show_groups = self.catalog.page(recommendation, page)
         message = f'Страница {page}:\n'
         message += '\n'.join([
             f'{i + 1}. {show_groups[i].name} -- '
@@ -308,16 +642,15 @@ class Bot:
                             payload=json.dumps(
                                 {'button': 'start_analysis'}))
         keyboard.add_line()
-        page_number = page - 1 if page > 1 else len(
-            group_ids) // 10 + 1
+        page_number = page - 1 if page > 1 else groups_count // 10 + 1
         keyboard.add_button(f'Страница {page_number}',
                             color=VkKeyboardColor.PRIMARY,
                             payload=json.dumps({
                                 'button':
                                     f'show_recommendation_{page_number}'
                             }))
-        page_number = (page + 1) % (len(group_ids) // 10 + 1)
-        page_number = page_number or len(group_ids) // 10 + 1
+        page_number = (page + 1) % (groups_count // 10 + 1)
+        page_number = page_number or groups_count // 10 + 1
         keyboard.add_button(f'Страница {page_number}',
                             color=VkKeyboardColor.PRIMARY,
                             payload=json.dumps({
@@ -325,38 +658,100 @@ class Bot:
                                     f'show_recommendation_{page_number}'
                             }))
         self.send_message(from_id, message, keyboard.get_keyboard())
-        user_status = self.get_user(from_id, users_session)
-        user_status.status = 'show_page'
-        user_status.page = page
-        users_session.commit()
+        self.user_states.set(from_id, status='show_page', page=page)
 
     def command_admin(self, from_id):
-        users_session = self.users_db.create_session()
         print(f'*** {from_id} entered admin panel')
 
+        msg = 'Вы вошли в панель администратора'
+        self.send_message(from_id, msg, self.admin_keyboard())
+        self.user_states.set(from_id, status='admin')
+
+    def command_admin_stats(self, from_id):
+        user_status = self.get_user(from_id)
+        if user_status and user_status.status == 'admin':
+            with self.models.use() as predictor:
+                msg = '\n\n'.join(
+                    f'{title}:\n' + '\n'.join(
+                        f'{key}: {round(value, 4)}'
+                        for key, value in stats.items())
+                    for title, stats in (
+                        (f'Предсказания ({predictor.model_name})',
+                         predictor.stats()),
+                        ('Лемматизация', predictor.cleaner.stats()),
+                        ('Кэш групп', self.prediction_cache.stats()),
+                        ('Стены групп', self.post_store.stats()),
+                        ('Размеченные группы', self.known_groups.stats()),
+                        ('Повторные анализы', self.snapshots.stats()),
+                        ('Каталог', self.catalog.stats()),
+                        ('Пользователи', self.user_states.stats()),
+                        ('База пользователей', self.users_db.stats()),
+                        ('База групп', self.groups_db.stats()),
+                        ('Запросы к VK', self.single_flight.stats()),
+                        ('Очередь сообщений', self.dispatcher.stats()
+                         if self.dispatcher else {}),
+                        ('Задачи анализа', self.jobs.stats()
+                         if self.jobs else {})))
+            self.send_message(from_id, msg, self.admin_keyboard())
+        else:
+            self.command_start(from_id)
+
+    def command_admin_models(self, from_id, payload):
+        user_status = self.get_user(from_id)
+        if not user_status or user_status.status != 'admin':
+            self.command_start(from_id)
+            return
+
+        if '#' in payload['button']:
+            name = payload['button'].split('#')[1]
+            self.send_message(from_id, f'Загрузка модели {name}...')
+            self.models.activate(name)
+
+        msg = 'Модели:\n'
+        keyboard = VkKeyboard(one_time=True)
+        for i, (name, stats) in enumerate(self.models.stats().items()):
+            msg += f'\n{name}'
+            if stats['active']:
+                msg += ' (активна)'
+            if stats['loaded']:
+                msg += (f': загружена за {stats["load_time"]:.1f} с, '
+                        f'веса {stats["weights_size"] / 2 ** 20:.1f} МБ')
+                if stats['size'] is not None:
+                    msg += f', память {stats["size"] / 2 ** 20:.1f} МБ'
+            if i and i % 2 == 0:
+                keyboard.add_line()
+            keyboard.add_button(name,
+                                color=(VkKeyboardColor.POSITIVE
+                                       if stats['active'] else
+                                       VkKeyboardColor.SECONDARY),
+                                payload=json.dumps(
+                                    {'button': f'admin_models#{name}'}))
+        keyboard.add_line()
+        keyboard.add_button('Назад',
+                            color=VkKeyboardColor.NEGATIVE,
+                            payload=json.dumps({'button': 'admin_stats'}))
+        self.send_message(from_id, msg, keyboard.get_keyboard())
+
+    @staticmethod
+    def admin_keyboard():
         keyboard = VkKeyboard(one_time=True)
         keyboard.add_button('Фильтровать датасет',
                             color=VkKeyboardColor.PRIMARY,
                             payload=json.dumps({'button': 'dataset_filter'}))
+        keyboard.add_button('Статистика',
+                            color=VkKeyboardColor.SECONDARY,
+                            payload=json.dumps({'button': 'admin_stats'}))
+        keyboard.add_button('Модели',
+                            color=VkKeyboardColor.SECONDARY,
+                            payload=json.dumps({'button': 'admin_models'}))
+        keyboard.add_line()
         keyboard.add_button('Выйти',
                             color=VkKeyboardColor.NEGATIVE,
                             payload=json.dumps({'command': 'start'}))
-        msg = 'Вы вошли в панель администратора'
-        self.send_message(from_id, msg, keyboard.get_keyboard())
-
-        user_status = self.get_user(from_id, users_session)
-        if user_status:
-            user_status.status = 'admin'
-        else:
-            users_session.add(
-                self.users_db.UserStatuses(user_id=from_id, status='admin'))
-        users_session.commit()
+        return keyboard.get_keyboard()
 
     def command_dataset_filter(self, from_id, payload):
-        users_session = self.users_db.create_session()
-        groups_session = self.groups_db.create_session()
-
-        user_status = self.get_user(from_id, users_session)
+        user_status = self.get_user(from_id)
         if user_status.status == 'admin':
             if '#' in payload['button']:
                 _, gr_id, cat = payload['button'].split('#')
@@ -364,21 +759,16 @@ class Bot:
                 if gr_id > self.latest_id:
                     self.latest_id = gr_id
                     cat = self.new_cats[int(cat)] if cat != '-1' else 'other'
-                    old_group = groups_session.query(
-                        self.groups_db.Groups).get(self.latest_id)
-                    users_session.add(self.groups_db.Groups(group_id=self.latest_id,
-                                                       name=old_group.name,
-                                                       subject=cat,
-                                                       link=old_group.link))
+                    old_group = self.catalog.get(self.latest_id)
+                    self.catalog.add(self.latest_id, old_group.name, cat,
+                                     old_group.link)
                     msg = (f"{old_group.name} теперь относится к группе "
                            f"{cat.capitalize()}")
                 else:
                     msg = f'Группа {gr_id} уже была добавлена'
                 self.send_message(from_id, msg)
 
-            group = groups_session.query(self.groups_db.Groups).order_by(
-                self.groups_db.Groups.group_id.asc()
-            ).filter(self.groups_db.Groups.group_id > self.latest_id).first()
+            group = self.catalog.next_group(self.latest_id)
 
             keyboard = VkKeyboard(one_time=True)
             msg = ('К какой категории относится эта группа?\n'
@@ -407,6 +797,5 @@ class Bot:
             msg = 'Начнём анализ?'
             self.send_message(from_id, msg, keyboard.get_keyboard())
     
-    def get_user(self, user_id, users_session):
-        return users_session.query(self.users_db.UserStatuses).filter(
-            self.users_db.UserStatuses.user_id == user_id).first()
+    def get_user(self, user_id):
+        return self.user_states.get(user_id)
@@ -0,0 +1,304 @@
+import threading
+from time import time, sleep
+from heapq import merge
+from bisect import bisect_right, insort
+from itertools import islice
+from sqlalchemy import func
+from sqlalchemy.exc import (OperationalError, ProgrammingError,
+                            SQLAlchemyError)
+
+
+class GroupRecord:
+    """row of the Groups or GroupsIds table"""
+    __slots__ = ('group_id', 'name', 'subject', 'link')
+
+    def __init__(self, group_id, name, subject, link):
+        self.group_id = group_id
+        self.name = name
+        self.subject = subject
+        self.link = link
+
+
+def save_group(db, group_id, name, subject, link):
+    """writes the group labeled by an admin to the Groups table"""
+    with db.session() as session:
+        session.merge(db.Groups(group_id=group_id, name=name,
+                                subject=subject, link=link))
+        session.commit()
+
+
+class GroupsCatalog:
+    """
+    Copy of the Groups and GroupsIds tables, loaded again every reload
+    seconds (0 - never) to get the groups labeled in other processes.
+    Groups are looked up by group_id and listed like in
+    RecommendationCatalog; groups labeled by admins are saved and added
+    with add.
+    """
+
+    def __init__(self, db, page_size=10, reload=10 * 60):
+        self.db = db
+        self.page_size = page_size
+        self.reload = reload
+        self.lock = threading.Lock()
+        # group_id -> GroupRecord of the Groups and of the GroupsIds table,
+        # subjects of the GroupsIds come from the csv and are not shown
+        self.groups = {}
+        self.unlabeled = {}
+        # subject -> sorted group IDs, sorted IDs of all the Groups
+        self.by_subject = {}
+        self.group_ids = []
+
+        self.counters = {'pages': 0, 'labeled': 0, 'reloads': 0}
+        self.counters_lock = threading.Lock()
+        self.load()
+        if reload > 0:
+            threading.Thread(target=self._loop, daemon=True,
+                             name='groups-catalog').start()
+
+    def _loop(self):
+        while True:
+            sleep(self.reload)
+            try:
+                self.load()
+            except SQLAlchemyError as e:
+                # the old copy is used until the next reload
+                print(f'Groups catalog is not reloaded: {e}')
+                continue
+            self.count(reloads=1)
+
+    def load(self):
+        groups = {}
+        unlabeled = {}
+        for table, records in ((self.db.Groups, groups),
+                               (self.db.GroupsIds, unlabeled)):
+            try:
+                with self.db.session() as session:
+                    rows = session.query(table.group_id, table.name,
+                                         table.subject, table.link).all()
+            except (OperationalError, ProgrammingError):
+                # GroupsIds is not in every database
+                rows = []
+            for row in rows:
+                records[row[0]] = GroupRecord(*row)
+
+        by_subject = {}
+        for group_id in sorted(groups):
+            by_subject.setdefault(groups[group_id].subject, []).append(
+                group_id)
+        with self.lock:
+            self.groups = groups
+            self.unlabeled = unlabeled
+            self.by_subject = by_subject
+            self.group_ids = sorted(groups)
+        print(f'{len(groups)} groups of {len(by_subject)} subjects and '
+              f'{len(unlabeled)} groups of the GroupsIds loaded')
+
+    def get(self, group_id):
+        """return GroupRecord of the group or None"""
+        with self.lock:
+            return self.groups.get(group_id) or self.unlabeled.get(group_id)
+
+    def subjects(self, group_ids):
+        """
+        return {group_id: subject} of the groups with a subject, subjects
+        of the Groups are used before the ones of the GroupsIds
+        """
+        subjects = {}
+        with self.lock:
+            for records in (self.unlabeled, self.groups):
+                subjects.update({group_id: records[group_id].subject
+                                 for group_id in group_ids
+                                 if group_id in records and
+                                 records[group_id].subject})
+        return subjects
+
+    def subject_sizes(self, subjects):
+        """return {subject: number of groups}"""
+        with self.lock:
+            return {subject: len(self.by_subject.get(subject, ()))
+                    for subject in subjects}
+
+    def size(self, subjects):
+        """return number of groups of all the subjects"""
+        return sum(self.subject_sizes(subjects).values())
+
+    def page(self, subjects, page):
+        """return GroupRecords of the page, pages are numbered from 1"""
+        offset = (page - 1) * self.page_size
+        with self.lock:
+            # groups of all the subjects ordered by group_id
+            group_ids = merge(*(self.by_subject.get(subject, [])
+                                for subject in dict.fromkeys(subjects)))
+            groups = [self.groups[group_id] for group_id in
+                      islice(group_ids, offset, offset + self.page_size)]
+        self.count(pages=1)
+        return groups
+
+    def latest_id(self):
+        """return the highest group_id of the Groups, 0 if there are none"""
+        with self.lock:
+            return self.group_ids[-1] if self.group_ids else 0
+
+    def next_group(self, group_id):
+        """return GroupRecord of the group following group_id or None"""
+        with self.lock:
+            i = bisect_right(self.group_ids, group_id)
+            if i < len(self.group_ids):
+                return self.groups[self.group_ids[i]]
+        return None
+
+    def add(self, group_id, name, subject, link):
+        """
+        saves the group labeled with subject to the groups database and
+        adds it, replaces the old label
+        """
+        save_group(self.db, group_id, name, subject, link)
+        with self.lock:
+            old = self.groups.get(group_id)
+            if old is not None:
+                self.by_subject[old.subject].remove(group_id)
+            else:
+                insort(self.group_ids, group_id)
+            self.groups[group_id] = GroupRecord(group_id, name, subject, link)
+            self.unlabeled.pop(group_id, None)
+            insort(self.by_subject.setdefault(subject, []), group_id)
+        self.count(labeled=1)
+
+    def count(self, **counters):
+        with self.counters_lock:
+            for key, value in counters.items():
+                self.counters[key] += value
+
+    def stats(self):
+        with self.counters_lock:
+            stats = dict(self.counters)
+        with self.lock:
+            stats.update(groups=len(self.groups),
+                         subjects=len(self.by_subject))
+        return stats
+
+
+class RecommendationCatalog:
+    """
+    Groups of the Groups table recommended for the subjects, page by page.
+    Groups of all the subjects are ordered by group_id, a page is read with
+    one query on the (subject, group_id) index. Numbers of groups of every
+    subject are cached for ttl seconds.
+    """
+
+    def __init__(self, db, page_size=10, ttl=60 * 60):
+        self.db = db
+        self.page_size = page_size
+        self.ttl = ttl
+        self.sizes = {}
+        self.sizes_lock = threading.Lock()
+
+        self.counters = {'pages': 0, 'sizes_cached': 0, 'sizes_counted': 0}
+        self.counters_lock = threading.Lock()
+
+    def subject_sizes(self, subjects):
+        """return {subject: number of groups}"""
+        now = time()
+        with self.sizes_lock:
+            sizes = {subject: self.sizes[subject][0] for subject in subjects
+                     if subject in self.sizes and
+                     now - self.sizes[subject][1] < self.ttl}
+        missing = [subject for subject in subjects if subject not in sizes]
+        if missing:
+            table = self.db.Groups
+            counted = dict.fromkeys(missing, 0)
+            with self.db.session() as session:
+                counted.update(session.query(
+                    table.subject, func.count(table.group_id)).filter(
+                    table.subject.in_(missing)).group_by(table.subject).all())
+            with self.sizes_lock:
+                self.sizes.update({subject: (size, now)
+                                   for subject, size in counted.items()})
+            sizes.update(counted)
+        self.count(sizes_cached=len(subjects) - len(missing),
+                   sizes_counted=len(missing))
+        return sizes
+
+    def size(self, subjects):
+        """return number of groups of all the subjects"""
+        return sum(self.subject_sizes(subjects).values())
+
+    def page(self, subjects, page):
+        """return Groups rows of the page, pages are numbered from 1"""
+        table = self.db.Groups
+        with self.db.session() as session:
+            groups = session.query(table).filter(
+                table.subject.in_(list(dict.fromkeys(subjects)))).order_by(
+                table.group_id).offset(
+                (page - 1) * self.page_size).limit(self.page_size).all()
+        self.count(pages=1)
+        return groups
+
+    def get(self, group_id):
+        """return Groups or GroupsIds row of the group or None"""
+        try:
+            with self.db.session() as session:
+                group = session.query(self.db.Groups).get(group_id)
+                if group is None:
+                    group = session.query(self.db.GroupsIds).get(group_id)
+        except (OperationalError, ProgrammingError):
+            # GroupsIds is not in every database
+            group = None
+        return group
+
+    def subjects(self, group_ids):
+        """
+        return {group_id: subject} of the groups with a subject, subjects
+        of the Groups are used before the ones of the GroupsIds
+        """
+        if not group_ids:
+            return {}
+        subjects = {}
+        for table in (self.db.GroupsIds, self.db.Groups):
+            try:
+                with self.db.session() as session:
+                    subjects.update(session.query(
+                        table.group_id, table.subject).filter(
+                        table.group_id.in_(group_ids),
+                        table.subject.isnot(None)).all())
+            except (OperationalError, ProgrammingError):
+                # GroupsIds is not in every database
+                pass
+        return subjects
+
+    def latest_id(self):
+        """return the highest group_id of the Groups, 0 if there are none"""
+        with self.db.session() as session:
+            latest = session.query(func.max(self.db.Groups.group_id)).scalar()
+        return latest or 0
+
+    def next_group(self, group_id):
+        """return Groups row of the group following group_id or None"""
+        table = self.db.Groups
+        with self.db.session() as session:
+            return session.query(table).filter(
+                table.group_id > group_id).order_by(table.group_id).first()
+
+    def add(self, group_id, name, subject, link):
+        """
+        saves the group labeled with subject to the groups database and
+        forgets the numbers of groups it changes
+        """
+        save_group(self.db, group_id, name, subject, link)
+        with self.sizes_lock:
+            self.sizes.clear()
+
+    def clear(self):
+        """forgets the numbers of groups after the Groups table is changed"""
+        with self.sizes_lock:
+            self.sizes.clear()
+
+    def count(self, **counters):
+        with self.counters_lock:
+            for key, value in counters.items():
+                self.counters[key] += value
+
+    def stats(self):
+        with self.counters_lock:
+            return dict(self.counters)
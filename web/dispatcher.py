@@ -0,0 +1,109 @@
+import threading
+from time import time
+from collections import deque
+from traceback import format_exc
+
+
+class Dispatcher:
+    """
+    Runs tasks in a fixed number of worker threads. Tasks with the same key
+    (a user ID) run one after another in the order they were submitted,
+    tasks without a key run independently. At most max_queue tasks wait for
+    a worker, new tasks are rejected while the queue is full.
+    """
+
+    def __init__(self, workers=8, max_queue=100):
+        self.workers = workers
+        self.max_queue = max_queue
+
+        # key -> tasks of the key that have not finished, the first one may
+        # be running; keys whose first task is waiting for a worker are in
+        # ready
+        self.tasks = {}
+        self.ready = deque()
+        self.queued = 0
+        self.running = 0
+        self.stopping = False
+        self.condition = threading.Condition()
+
+        self.submitted = 0
+        self.rejected = 0
+        self.wait_time = 0.
+
+        self.threads = [threading.Thread(target=self._loop, daemon=True,
+                                         name=f'dispatcher-{i}')
+                        for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, key, function, *args):
+        """
+        :param key: tasks with the same key are not run at the same time,
+        None for a task that can run with any other
+        :return: position of the task in the queue, 0 if it starts at once,
+        None if the queue is full and the task is rejected
+        """
+        with self.condition:
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                return None
+            if key is None:
+                key = object()
+            waits = (key in self.tasks or
+                     len(self.ready) >= self.workers - self.running)
+            position = self.queued + 1 if waits else 0
+
+            if key not in self.tasks:
+                self.tasks[key] = deque()
+                self.ready.append(key)
+                self.condition.notify()
+            self.tasks[key].append((function, args, time()))
+            self.queued += 1
+            self.submitted += 1
+            return position
+
+    def _loop(self):
+        while True:
+            with self.condition:
+                while not self.ready and not self.stopping:
+                    self.condition.wait()
+                if not self.ready:
+                    return
+                key = self.ready.popleft()
+                function, args, submitted = self.tasks[key][0]
+                self.queued -= 1
+                self.running += 1
+                self.wait_time += time() - submitted
+
+            try:
+                function(*args)
+            except Exception:
+                print(format_exc())
+            finally:
+                with self.condition:
+                    self.running -= 1
+                    self.tasks[key].popleft()
+                    if self.tasks[key]:
+                        self.ready.append(key)
+                        self.condition.notify()
+                    else:
+                        del self.tasks[key]
+
+    def close(self):
+        """stops the workers after the queued tasks are done"""
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+
+    def stats(self):
+        with self.condition:
+            started = self.submitted - self.queued
+            return {'workers': self.workers,
+                    'running': self.running,
+                    'queued': self.queued,
+                    'submitted': self.submitted,
+                    'rejected': self.rejected,
+                    'average_wait': self.wait_time / started
+                    if started else 0}
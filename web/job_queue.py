@@ -0,0 +1,116 @@
+from time import time
+from sqlalchemy import or_, and_, func
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class JobQueue:
+    """
+    Analyses stored as jobs in the AnalysisJobs table, so they are run by
+    worker processes (worker.py) and survive restarts. A running job whose
+    worker has not finished it in lease seconds is given to another worker,
+    a job is failed after max_attempts attempts.
+    """
+
+    def __init__(self, db, max_attempts=3, lease=10 * 60):
+        self.db = db
+        db.create_tables(db.AnalysisJobs)
+        self.max_attempts = max_attempts
+        self.lease = lease
+
+    def enqueue(self, user_id):
+        """
+        :return: new job of the user, or the job that is already queued or
+        running, and whether it is new
+        """
+        table = self.db.AnalysisJobs
+        with self.db.session() as session:
+            job = session.query(table).filter(
+                table.user_id == user_id,
+                table.state.in_([QUEUED, RUNNING])).first()
+            created = job is None
+            if created:
+                job = table(user_id=user_id, state=QUEUED, attempts=0,
+                            created=time())
+                session.add(job)
+                session.commit()
+                session.refresh(job)
+            session.expunge(job)
+        return job, created
+
+    def claimable(self, now):
+        table = self.db.AnalysisJobs
+        return or_(table.state == QUEUED,
+                   and_(table.state == RUNNING,
+                        table.started < now - self.lease))
+
+    def claim(self, worker):
+        """
+        :param worker: name of the worker
+        :return: the oldest job that can be run, marked as running by the
+        worker, or None
+        """
+        table = self.db.AnalysisJobs
+        now = time()
+        with self.db.session() as session:
+            session.query(table).filter(
+                table.state == RUNNING, table.started < now - self.lease,
+                table.attempts >= self.max_attempts).update(
+                {'state': FAILED, 'finished': now, 'error': 'lease expired'},
+                synchronize_session=False)
+            session.commit()
+
+            candidates = session.query(table.id).filter(
+                self.claimable(now)).order_by(table.id).limit(10).all()
+            for job_id, in candidates:
+                # only one worker changes the row, the others update nothing
+                claimed = session.query(table).filter(
+                    table.id == job_id, self.claimable(now)).update(
+                    {'state': RUNNING, 'worker': worker, 'started': now,
+                     'attempts': table.attempts + 1},
+                    synchronize_session=False)
+                session.commit()
+                if claimed:
+                    job = session.query(table).get(job_id)
+                    session.expunge(job)
+                    return job
+        return None
+
+    def finish(self, job):
+        self._update(job, state=DONE, finished=time())
+
+    def fail(self, job, error):
+        """queues the job again or fails it after max_attempts attempts"""
+        if job.attempts < self.max_attempts:
+            self._update(job, state=QUEUED, error=error)
+        else:
+            self._update(job, state=FAILED, error=error, finished=time())
+
+    def _update(self, job, **values):
+        table = self.db.AnalysisJobs
+        with self.db.session() as session:
+            # the job may have been given to another worker after the lease
+            session.query(table).filter(
+                table.id == job.id, table.worker == job.worker,
+                table.attempts == job.attempts,
+                table.state == RUNNING).update(values,
+                                               synchronize_session=False)
+            session.commit()
+
+    def position(self, job):
+        """return number of queued jobs up to this one"""
+        table = self.db.AnalysisJobs
+        with self.db.session() as session:
+            return session.query(table).filter(
+                table.state == QUEUED, table.id <= job.id).count()
+
+    def stats(self):
+        table = self.db.AnalysisJobs
+        with self.db.session() as session:
+            counts = dict(session.query(table.state, func.count(table.id)
+                                        ).group_by(table.state))
+        return {state: counts.get(state, 0)
+                for state in (QUEUED, RUNNING, DONE, FAILED)}
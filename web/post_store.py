@@ -0,0 +1,144 @@
+import threading
+from time import time
+from typing import List, Dict, Tuple
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+
+class PostStore:
+    """
+    Walls of VK groups stored in the GroupWalls and GroupPosts tables, so the
+    bot and the dataset builders download every wall once in ttl seconds.
+    Walls that could not be read are stored with their error code. Posts
+    are returned in the order of wall.get, with the pinned post first.
+    """
+
+    def __init__(self, db, fetcher, ttl=6 * 60 * 60):
+        """
+        :param db: database with the GroupWalls and GroupPosts tables
+        :param fetcher: WallFetcher used for missing and outdated walls
+        :param ttl: seconds after which a wall is downloaded again
+        """
+        self.db = db
+        db.create_tables(db.GroupWalls, db.GroupPosts)
+        self.fetcher = fetcher
+        self.ttl = ttl
+
+        self.counters = {'stored': 0, 'fetched': 0}
+        self.counters_lock = threading.Lock()
+
+    def get(self, group_ids: List[int], count=10) -> Tuple[
+        Dict[int, List[Dict]], Dict[int, Dict]
+    ]:
+        """
+        same as WallFetcher.fetch, walls fetched less than ttl seconds ago
+        with at least count posts are read from the database
+        """
+        walls, errors = self.read(group_ids, count, max_age=self.ttl)
+        missing = [_id for _id in group_ids
+                   if _id not in walls and _id not in errors]
+        if missing:
+            fetched_walls, fetched_errors = self.fetcher.fetch(missing, count)
+            self.put(fetched_walls, fetched_errors, count)
+            walls.update(fetched_walls)
+            errors.update(fetched_errors)
+        with self.counters_lock:
+            self.counters['stored'] += len(group_ids) - len(missing)
+            self.counters['fetched'] += len(missing)
+        return walls, errors
+
+    def read(self, group_ids: List[int], count=10, max_age=None) -> Tuple[
+        Dict[int, List[Dict]], Dict[int, Dict]
+    ]:
+        """
+        :return: stored walls and errors of the groups, only the walls stored
+        with at least count posts and less than max_age seconds ago
+        """
+        if not group_ids:
+            return {}, {}
+        walls_table = self.db.GroupWalls
+        posts_table = self.db.GroupPosts
+        with self.db.session() as session:
+            query = session.query(walls_table).filter(
+                walls_table.group_id.in_(group_ids))
+            if max_age is not None:
+                query = query.filter(walls_table.fetched > time() - max_age)
+
+            walls = {}
+            errors = {}
+            for wall in query:
+                if wall.error_code is not None:
+                    errors[wall.group_id] = {'error_code': wall.error_code,
+                                             'error_msg': 'Stored error'}
+                elif wall.post_count >= count:
+                    walls[wall.group_id] = []
+            if walls:
+                for post in session.query(posts_table).filter(
+                        posts_table.group_id.in_(list(walls))).order_by(
+                        posts_table.group_id, posts_table.position):
+                    posts = walls[post.group_id]
+                    if len(posts) < count:
+                        posts.append({'id': post.post_id,
+                                      'owner_id': -post.group_id,
+                                      'text': post.text,
+                                      'marked_as_ads': post.marked_as_ads,
+                                      'date': post.date})
+        return walls, errors
+
+    def put(self, walls: Dict[int, List[Dict]], errors: Dict[int, Dict],
+            count=10):
+        """
+        replaces the stored walls of the groups
+
+        :param walls: {group_id: list of posts} got with count posts
+        :param errors: {group_id: error} for the walls that were not read
+        :param count: number of posts that was requested
+        """
+        group_ids = list(walls) + list(errors)
+        if not group_ids:
+            return
+        walls_table = self.db.GroupWalls
+        posts_table = self.db.GroupPosts
+        now = time()
+        with self.db.session() as session:
+            for attempt in range(3):
+                try:
+                    for table in posts_table, walls_table:
+                        session.query(table).filter(
+                            table.group_id.in_(group_ids)).delete(
+                            synchronize_session=False)
+                    session.bulk_insert_mappings(posts_table, [
+                        {'group_id': group_id,
+                         'post_id': post['id'],
+                         'position': position,
+                         'text': post['text'],
+                         'marked_as_ads': post.get('marked_as_ads', 0),
+                         'date': post.get('date')}
+                        for group_id, posts in walls.items()
+                        for position, post in enumerate({
+                            post['id']: post for post in posts}.values())
+                    ])
+                    session.bulk_insert_mappings(walls_table, [
+                        {'group_id': group_id,
+                         'post_count': count,
+                         'error_code': errors[group_id].get('error_code')
+                         if group_id in errors else None,
+                         'fetched': now}
+                        for group_id in group_ids])
+                    session.commit()
+                    break
+                except IntegrityError:
+                    # another thread has stored some of the walls
+                    session.rollback()
+                except OperationalError as e:
+                    # the database is locked by other writers for too long,
+                    # the walls will be downloaded again next time
+                    session.rollback()
+                    print(f'Walls are not stored: {e.orig}')
+                    break
+
+    def stats(self):
+        with self.counters_lock:
+            total = self.counters['stored'] + self.counters['fetched']
+            return {**self.counters,
+                    'stored_share': self.counters['stored'] / total
+                    if total else 0}
@@ -0,0 +1,109 @@
+import random
+import threading
+from time import monotonic, sleep
+from contextlib import nullcontext
+
+import vk_api
+from vk_api.exceptions import ApiError
+
+TOO_MANY_REQUESTS = 6
+RATE_LIMIT_REACHED = 29
+RATE_ERRORS = (TOO_MANY_REQUESTS, RATE_LIMIT_REACHED)
+
+
+class TokenBucket:
+    """
+    allows rate requests per second on average and bursts of capacity;
+    VK counts requests in any second, so bursts are off by default
+    """
+
+    def __init__(self, rate, capacity=1.):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = self.capacity
+        self.updated = monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """waits until a request can be sent"""
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.tokens = min(self.capacity, self.tokens +
+                                  (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            sleep(wait)
+
+    def drain(self):
+        """spends all tokens, used when VK says that requests are too often"""
+        with self.lock:
+            self.tokens = min(self.tokens, 0)
+            self.updated = monotonic()
+
+
+class RateLimiter:
+    """process-wide token buckets, one for every access token"""
+
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, token, rate):
+        """return bucket of the token, the rate is used for a new bucket"""
+        with self.lock:
+            if token not in self.buckets:
+                self.buckets[token] = TokenBucket(rate)
+            return self.buckets[token]
+
+
+RATE_LIMITER = RateLimiter()
+
+
+def backoff(attempt, base=0.5, limit=30.):
+    """return exponential delay with jitter for the attempt (from 0)"""
+    return min(limit, base * 2 ** attempt) * random.uniform(0.5, 1.)
+
+
+class RateLimitMixin:
+    """
+    Replaces VkApi's lock, which sends one request at a time, and its fixed
+    delay with the shared token bucket of the access token. Requests failed
+    with errors 6 (too many requests per second) and 29 (rate limit reached)
+    are sent again after a growing delay, up to retries times.
+    """
+
+    RPS_DELAY = 0
+    retries = 5
+
+    def init_rate_limit(self, token, rps):
+        self.lock = nullcontext()
+        self.error_handlers.pop(TOO_MANY_REQUESTS, None)
+        self.bucket = RATE_LIMITER.bucket(token, rps)
+
+    def method(self, method, values=None, **kwargs):
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            try:
+                return super().method(method, values, **kwargs)
+            except ApiError as e:
+                if e.code not in RATE_ERRORS or attempt == self.retries:
+                    raise
+                self.bucket.drain()
+                delay = backoff(attempt)
+                print(f'VK error {e.code} on {method}, '
+                      f'retry in {delay:.1f}s')
+                sleep(delay)
+
+
+class RateLimitedVkApi(RateLimitMixin, vk_api.VkApi):
+    def __init__(self, *args, rps=3, **kwargs):
+        """
+        takes the same arguments as VkApi and rps, the number of requests
+        per second allowed for the token across the whole process
+        """
+        super().__init__(*args, **kwargs)
+        self.init_rate_limit(kwargs.get('token'), rps)
@@ -0,0 +1,125 @@
+import os
+import sys
+import signal
+import multiprocessing
+
+from vk_api.bot_longpoll import (VkBotLongPoll, VkBotEventType,
+                                 VkBotMessageEvent)
+from vk_api.utils import get_random_id
+
+from web.rate_limiter import RateLimitedVkApi
+
+
+def shard_of(from_id: int, shards: int) -> int:
+    """return number of the worker handling messages of the user"""
+    return abs(from_id) % shards
+
+
+def run_shard(make_bot, events) -> None:
+    """
+    handles messages from the queue with the bot made by make_bot() until
+    None is received, runs in a worker process
+    """
+    bot = make_bot()
+    # the worker is stopped with SIGTERM together with the listener
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    try:
+        while True:
+            raw = events.get()
+            if raw is None:
+                break
+            event = VkBotMessageEvent(raw)
+            if bot.dispatcher is None:
+                bot.process_new_message(event)
+            else:
+                bot.dispatch(event)
+    finally:
+        if bot.dispatcher is not None:
+            bot.dispatcher.close()
+        # worker processes exit without running atexit handlers
+        bot.user_states.close()
+
+
+class ShardedListener:
+    """
+    Owns the long poll of the group and forwards new messages to worker
+    processes, each running its own Bot. Messages of a user always go to
+    the same worker, so their order and the check that an analysis is
+    running stay correct without memory shared between the processes.
+    Can be used instead of Bot in main.py.
+    """
+
+    def __init__(self, make_bot, shards, queue_size=1000,
+                 group_vk_session=None):
+        """
+        :param make_bot: function without arguments returning a Bot,
+        called in every worker process
+        :param shards: number of worker processes
+        :param queue_size: number of messages waiting for a worker, the
+        long poll waits when the queue of a worker is full
+        :param group_vk_session: VkApi with the group token,
+        made from GROUP_TOKEN by default
+        """
+        self.group_id = int(os.environ['GROUP_ID'])
+        if group_vk_session is None:
+            group_vk_session = RateLimitedVkApi(
+                token=os.environ['GROUP_TOKEN'], api_version='5.126',
+                rps=float(os.environ.get('VK_GROUP_RPS', 20)) / (shards + 1))
+        self.groups_session = group_vk_session
+        self.group_api = group_vk_session.get_api()
+        self.long_poll = None
+
+        self.make_bot = make_bot
+        self.queues = [multiprocessing.Queue(queue_size)
+                       for _ in range(shards)]
+        self.processes = [None] * shards
+        self.forwarded = [0] * shards
+
+    def start(self) -> None:
+        for index in range(len(self.queues)):
+            self.start_shard(index)
+
+    def start_shard(self, index: int) -> None:
+        process = multiprocessing.Process(
+            target=run_shard, args=(self.make_bot, self.queues[index]),
+            name=f'shard-{index}', daemon=True)
+        process.start()
+        self.processes[index] = process
+
+    def forward(self, event) -> None:
+        """sends the message event to the worker of its user"""
+        from_id = event.object['message']['from_id']
+        index = shard_of(from_id, len(self.queues))
+        if self.processes[index] is None or \
+                not self.processes[index].is_alive():
+            print(f'Shard {index} is not running, starting it')
+            self.start_shard(index)
+        self.queues[index].put(event.raw)
+        self.forwarded[index] += 1
+
+    def listen(self) -> None:
+        """
+        gets updates from server and forwards them to the workers
+        :return: None
+        """
+        if not any(self.processes):
+            self.start()
+        if self.long_poll is None:
+            self.long_poll = VkBotLongPoll(self.groups_session, self.group_id)
+        for event in self.long_poll.listen():
+            if event.type == VkBotEventType.MESSAGE_NEW:
+                self.forward(event)
+
+    def send_message(self, user_id: int, message: str) -> None:
+        """sends a message from the group, used to report errors"""
+        self.group_api.messages.send(user_id=user_id,
+                                     random_id=get_random_id(),
+                                     message=message)
+
+    def close(self) -> None:
+        """stops the workers after they handle the queued messages"""
+        for queue in self.queues:
+            queue.put(None)
+        for process in self.processes:
+            if process is not None:
+                process.join()
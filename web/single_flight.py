@@ -0,0 +1,80 @@
+import threading
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces identical requests made by different threads: while a request
+    with some key is in flight, the threads asking for the same key wait for
+    its result instead of sending it again.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.requested = 0
+        self.saved = 0
+
+    def do(self, key, function, *args, **kwargs):
+        """return function(*args, **kwargs), shared by callers with the key"""
+        return self.do_many(
+            [key], lambda keys: {key: function(*args, **kwargs)})[key]
+
+    def do_many(self, keys, function):
+        """
+        :param keys: keys of the requests
+        :param function: function(keys) -> {key: result} for the keys that
+        are not in flight yet, sends them in one request
+        :return: {key: result} for all the keys, None for the keys missing
+        in the function result
+        """
+        own = []
+        waiting = {}
+        with self.lock:
+            for key in dict.fromkeys(keys):
+                if key in self.calls:
+                    waiting[key] = self.calls[key]
+                else:
+                    self.calls[key] = _Call()
+                    own.append(key)
+            self.requested += len(own)
+            self.saved += len(waiting)
+
+        results = {}
+        error = None
+        try:
+            if own:
+                results = function(own)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            with self.lock:
+                for key in own:
+                    call = self.calls.pop(key)
+                    call.result = results.get(key)
+                    call.error = error
+                    call.done.set()
+
+        for key, call in waiting.items():
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            results[key] = call.result
+        return {key: results.get(key) for key in keys}
+
+    def stats(self):
+        with self.lock:
+            total = self.requested + self.saved
+            return {'requested': self.requested,
+                    'saved': self.saved,
+                    'saved_share': self.saved / total if total else 0,
+                    'in_flight': len(self.calls)}
@@ -0,0 +1,159 @@
+import threading
+from time import time
+from sqlalchemy.exc import SQLAlchemyError
+
+FIELDS = ('status', 'page', 'subjects')
+
+
+class UserState:
+    """row of the UserStatuses table"""
+    __slots__ = ('user_id', 'status', 'page', 'subjects')
+
+    def __init__(self, user_id, status=None, page=None, subjects=None):
+        self.user_id = user_id
+        self.status = status
+        self.page = page
+        self.subjects = subjects
+
+
+class UserStates:
+    """
+    Write-behind cache of the UserStatuses table. Users are read from the
+    database once and then served from memory for ttl seconds; changed
+    fields are written in one batch every flush_interval seconds, as soon as
+    max_dirty users are changed, and by close. Only the changed columns are
+    written, so fields set by another process (a job worker) are kept.
+    """
+
+    def __init__(self, db, flush_interval=1., max_dirty=100, ttl=10 * 60):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.max_dirty = max_dirty
+        self.ttl = ttl
+
+        # user_id -> UserState, None for users missing in the database
+        self.users = {}
+        self.loaded = {}
+        # user_id -> names of the fields changed since the last flush
+        self.dirty = {}
+        self.lock = threading.Lock()
+        # one flush at a time, so older changes are not written over newer
+        self.flush_lock = threading.Lock()
+
+        self.counters = {'hits': 0, 'loads': 0, 'flushes': 0, 'written': 0,
+                         'flush_errors': 0}
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._loop, daemon=True,
+                                       name='user-states')
+        self.thread.start()
+
+    def get(self, user_id):
+        """return UserState of the user or None if there is no such user"""
+        with self.lock:
+            if (user_id in self.users and
+                    time() - self.loaded[user_id] < self.ttl):
+                self.counters['hits'] += 1
+                return self.users[user_id]
+
+        table = self.db.UserStatuses
+        with self.db.session() as session:
+            row = session.query(table).filter(
+                table.user_id == user_id).first()
+        loaded = None if row is None else UserState(
+            row.user_id, row.status, row.page, row.subjects)
+
+        with self.lock:
+            self.counters['loads'] += 1
+            if user_id in self.dirty:
+                # the changes not written yet are kept
+                user = self.users[user_id]
+                if loaded is not None:
+                    for key in FIELDS:
+                        if key not in self.dirty[user_id]:
+                            setattr(user, key, getattr(loaded, key))
+                loaded = user
+            self.users[user_id] = loaded
+            self.loaded[user_id] = time()
+            return loaded
+
+    def set(self, user_id, **fields):
+        """changes fields of the user, adds the user if there is no one"""
+        user = self.get(user_id)
+        with self.lock:
+            user = self.users.get(user_id) or user
+            if user is None:
+                user = UserState(user_id)
+            for key, value in fields.items():
+                setattr(user, key, value)
+            self.users[user_id] = user
+            self.loaded[user_id] = time()
+            self.dirty.setdefault(user_id, set()).update(fields)
+            full = len(self.dirty) >= self.max_dirty
+        if full:
+            self.flush()
+        return user
+
+    def flush(self):
+        """writes the changed users to the database"""
+        with self.flush_lock:
+            with self.lock:
+                dirty, self.dirty = self.dirty, {}
+                rows = {user_id: {'user_id': user_id,
+                                  **{key: getattr(self.users[user_id], key)
+                                     for key in FIELDS}}
+                        for user_id in dirty}
+            if not rows:
+                return
+
+            table = self.db.UserStatuses
+            try:
+                with self.db.session() as session:
+                    existing = {user_id for user_id, in session.query(
+                        table.user_id).filter(table.user_id.in_(list(rows)))}
+                    # the other columns may be changed by another process
+                    session.bulk_update_mappings(
+                        table, [{'user_id': user_id,
+                                 **{key: row[key] for key in dirty[user_id]}}
+                                for user_id, row in rows.items()
+                                if user_id in existing])
+                    session.bulk_insert_mappings(
+                        table, [row for user_id, row in rows.items()
+                                if user_id not in existing])
+                    session.commit()
+            except SQLAlchemyError as e:
+                # written with the next flush
+                with self.lock:
+                    for user_id, fields in dirty.items():
+                        self.dirty.setdefault(user_id, set()).update(fields)
+                    self.counters['flush_errors'] += 1
+                print(f'User statuses are not written: {e}')
+                return
+        with self.lock:
+            self.counters['flushes'] += 1
+            self.counters['written'] += len(rows)
+
+    def prune(self):
+        """forgets the unchanged users read more than ttl seconds ago"""
+        now = time()
+        with self.lock:
+            for user_id in [user_id for user_id, loaded in self.loaded.items()
+                            if now - loaded >= self.ttl and
+                            user_id not in self.dirty]:
+                del self.users[user_id]
+                del self.loaded[user_id]
+
+    def _loop(self):
+        while not self.stopping.wait(self.flush_interval):
+            self.flush()
+            self.prune()
+
+    def close(self):
+        """stops the timer and writes the changes left"""
+        self.stopping.set()
+        self.thread.join()
+        self.flush()
+
+    def stats(self):
+        with self.lock:
+            return {**self.counters, 'cached': len(self.users),
+                    'dirty': len(self.dirty)}
@@ -0,0 +1,121 @@
+from time import sleep
+from operator import itemgetter
+from typing import List, Dict, Tuple
+from concurrent.futures import ThreadPoolExecutor
+
+from vk_api.requests_pool import vk_request_one_param_pool
+
+from web.rate_limiter import RATE_ERRORS, backoff
+
+# VK runs at most 25 API calls inside one execute
+EXECUTE_LIMIT = 25
+
+
+def posts_text(posts: List[Dict]) -> str:
+    """joins texts of the posts that are not marked as ads"""
+    return '\n'.join(map(itemgetter('text'),
+                         filter(lambda x: not x['marked_as_ads'], posts)))
+
+
+class WallFetcher:
+    """
+    Gets walls of many groups with wall.get calls packed by 25 into one
+    execute request (https://vk.com/dev/execute). An error of one call
+    (closed wall, deactivated group) does not fail the others. Up to
+    workers execute requests are sent at the same time, so with a
+    RateLimitedVkApi session the time depends on its requests per second
+    rather than on the sum of round-trips. With a SingleFlight, walls that
+    are being fetched for another thread are not requested again.
+    """
+
+    def __init__(self, vk_session, workers=4, retries=3, single_flight=None):
+        """
+        :param vk_session: VkApi with a service or user token
+        :param workers: number of execute requests sent at the same time,
+        the pool is shared by all threads using the fetcher
+        :param retries: how many times calls failed inside execute with
+        rate limit errors (6, 29) are repeated
+        :param single_flight: SingleFlight shared with other VK requests
+        """
+        self.vk_session = vk_session
+        self.retries = retries
+        self.single_flight = single_flight
+        self.executor = ThreadPoolExecutor(workers,
+                                           thread_name_prefix='wall-fetcher')
+
+    def fetch(self, group_ids: List[int], count=10) -> Tuple[
+        Dict[int, List[Dict]], Dict[int, Dict]
+    ]:
+        """
+        :param group_ids: group IDs
+        :param count: number of posts from every wall
+        :return: {group_id: list of posts} and {group_id: error} for the
+        groups whose walls could not be read
+        """
+        if self.single_flight is None:
+            return self.request(group_ids, count)
+
+        def request(keys):
+            walls, errors = self.request([key[1] for key in keys], count)
+            return {key: (walls.get(key[1]), errors.get(key[1]))
+                    for key in keys}
+
+        results = self.single_flight.do_many(
+            [('walls', group_id, count) for group_id in group_ids],
+            request)
+        walls = {}
+        errors = {}
+        for (_, group_id, _), (wall, error) in results.items():
+            if wall is not None:
+                walls[group_id] = wall
+            if error is not None:
+                errors[group_id] = error
+        return walls, errors
+
+    def request(self, group_ids: List[int], count=10) -> Tuple[
+        Dict[int, List[Dict]], Dict[int, Dict]
+    ]:
+        """fetch without coalescing with requests of other threads"""
+        chunks = [group_ids[i:i + EXECUTE_LIMIT]
+                  for i in range(0, len(group_ids), EXECUTE_LIMIT)]
+        walls = {}
+        errors = {}
+        for chunk_walls, chunk_errors in self.executor.map(
+                lambda chunk: self.fetch_chunk(chunk, count), chunks):
+            walls.update(chunk_walls)
+            errors.update(chunk_errors)
+        return walls, errors
+
+    def fetch_chunk(self, group_ids: List[int], count=10) -> Tuple[
+        Dict[int, List[Dict]], Dict[int, Dict]
+    ]:
+        """fetch for at most EXECUTE_LIMIT groups in one execute request"""
+        walls = {}
+        errors = {}
+        owner_ids = [-abs(group_id) for group_id in group_ids]
+        for attempt in range(self.retries + 1):
+            response, batch_errors = vk_request_one_param_pool(
+                self.vk_session, 'wall.get', key='owner_id',
+                values=owner_ids, default_values={'count': count})
+            for owner_id, wall in response.items():
+                walls[-owner_id] = wall['items']
+            owner_ids = []
+            for owner_id, error in batch_errors.items():
+                if error.get('error_code') in RATE_ERRORS and \
+                        attempt < self.retries:
+                    owner_ids.append(owner_id)
+                else:
+                    errors[-owner_id] = error
+            if not owner_ids:
+                break
+            sleep(backoff(attempt))
+        return walls, errors
+
+    def fetch_texts(self, group_ids: List[int], count=10) -> Dict[int, str]:
+        """
+        :return: {group_id: texts of posts joined like Bot.get_posts does}
+        for the groups whose walls could be read
+        """
+        walls, _ = self.fetch(group_ids, count)
+        return {group_id: posts_text(posts)
+                for group_id, posts in walls.items()}
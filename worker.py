@@ -0,0 +1,49 @@
+import os
+import sys
+import socket
+from time import sleep
+from traceback import format_exc
+from web import Bot
+from web.job_queue import JobQueue
+from database.db_session import DataBase
+
+
+def start_worker():
+    """runs analyses queued by the bot started with ANALYSIS_MODE=jobs"""
+    if os.environ.get('ANALYSIS_MODE') != 'jobs':
+        # the bot runs the analyses itself, there will be no jobs
+        print('Worker is not started: ANALYSIS_MODE is not "jobs", '
+              'scale the analysis process to 0')
+        sys.exit(0)
+    users_db = DataBase(os.environ.get('DATABASE_URL'))
+    groups_db = DataBase(
+        'sqlite:///database/db.sqlite?check_same_thread=false')
+    model_name = os.environ.get("MODEL_NAME", 'vk_not_filtered')
+    poll_interval = float(os.environ.get('JOB_POLL_INTERVAL', 1))
+    name = f'{socket.gethostname()}-{os.getpid()}'
+
+    bot = Bot(users_db, groups_db, model_name, worker=True)
+    jobs = JobQueue(users_db,
+                    max_attempts=int(os.environ.get('JOB_MAX_ATTEMPTS', 3)),
+                    lease=int(os.environ.get('JOB_LEASE', 10 * 60)))
+    print(f'Worker {name} started')
+    while True:
+        job = jobs.claim(name)
+        if job is None:
+            sleep(poll_interval)
+            continue
+        print(f'=== job {job.id}: analysis of {job.user_id} '
+              f'(attempt {job.attempts})')
+        try:
+            bot.command_start_analysis(job.user_id)
+        except Exception as e:
+            print('=== ERROR ===')
+            print(format_exc())
+            print('=============')
+            jobs.fail(job, repr(e))
+        else:
+            jobs.finish(job)
+
+
+if __name__ == '__main__':
+    start_worker()